@@ -0,0 +1,139 @@
+import threading
+import Queue
+
+"""
+
+Generating shaders on a background thread, so making new variants does not stall the frame.
+
+A BackgroundBuilder generates shader source for a ShaderBuilder on a worker thread.
+Only the source generation is done there: making the Shaders from the source, and calling back with them,
+is done by poll, which should be called regularly on the main thread (for example from a task, see pollTask).
+
+While a variant is being generated, something else has to be used in its place. manager.Manager does this
+with a placeholder shader from a (small, quick to generate) script, see Manager.setPlaceholder.
+
+Source generation holds shaderBuilder.generationLock, so generating shaders on the main thread
+(ex: with ShaderBuilder.getShader) will wait for the variant being generated on the worker,
+unless told not to (see the wait argument of ShaderBuilder.getShader). Checking the caches does not wait.
+The worker is a python thread, so it shares the interpreter with the main thread: it keeps frames from stalling,
+but does not make generation any faster overall.
+
+"""
+
+class BackgroundBuilder(object):
+    """
+
+    Generates shaders for a ShaderBuilder on a worker thread.
+
+    Call poll regularly to make the generated shaders and pass them to their callbacks.
+
+    """
+    def __init__(self,builder):
+        self.builder=builder
+        # maps RenderState to the list of callbacks waiting for its shader
+        self.pending={}
+        self.requests=Queue.Queue()
+        self.results=Queue.Queue()
+        self.thread=threading.Thread(target=self._run,name="BackgroundBuilder")
+        self.thread.daemon=True
+        self.thread.start()
+
+    def getShader(self,renderState,callback):
+        """
+        returns the shader for renderState if it is cached (see ShaderBuilder.getCachedShader).
+        Otherwise returns None, and queues it for generation: callback(shader) will be called from poll when it is done,
+        or callback(None) if the generator graph rejected renderState.
+        """
+        shader=self.builder.getCachedShader(renderState)
+        if shader: return shader
+
+        callbacks=self.pending.get(renderState)
+        if callbacks is None:
+            self.pending[renderState]=[callback]
+            self.requests.put(renderState)
+        else:
+            callbacks.append(callback)
+        return None
+
+    def _run(self):
+        while True:
+            renderState=self.requests.get()
+            if renderState is None: return
+            graph=self.builder.nodes
+            try:
+                generated=self.builder.generateSource(renderState)
+            except AssertionError as e:
+                generated=e
+            self.results.put((renderState,graph,generated))
+
+    def poll(self):
+        """
+        makes the shaders for the variants that have been generated, and calls their callbacks.
+        returns the number of variants completed.
+
+        If the generator graph rejected a RenderState, its callbacks get None, and the AssertionError is raised here
+        (after the other completed variants are handled), just like getShader would.
+        """
+        done=0
+        error=None
+        while True:
+            try:
+                renderState,graph,generated=self.results.get_nowait()
+            except Queue.Empty:
+                break
+            if graph is not self.builder.nodes:
+                # the builder was reloaded (see Library.reloadScript) while this was being generated
+                self.requests.put(renderState)
+                continue
+            callbacks=self.pending.pop(renderState)
+            if isinstance(generated,AssertionError):
+                error=generated
+                for callback in callbacks:
+                    callback(None)
+                continue
+            stages,source=generated
+            shader=self.builder._addShader(renderState,stages,source)
+            for callback in callbacks:
+                callback(shader)
+            done+=1
+        if error is not None: raise error
+        return done
+
+    def pollTask(self,task):
+        """
+        a Panda3D task that polls every frame, for example:
+        taskMgr.add(backgroundBuilder.pollTask,"shaderBackground")
+        """
+        self.poll()
+        return task.cont
+
+    def getPendingCount(self):
+        """ returns the number of variants queued or being generated """
+        return len(self.pending)
+
+    def stop(self):
+        """ stops the worker thread once it has finished the variants already queued """
+        self.requests.put(None)
+        self.thread.join()
+
+    def finish(self):
+        """
+        stops the worker thread, and completes all the variants that were requested: the ones it generated are polled,
+        and any left (ex: queued again after a reload) are generated on this thread. Callbacks are called as in poll.
+        """
+        self.stop()
+        error=None
+        try:
+            self.poll()
+        except AssertionError as e:
+            error=e
+        for renderState,callbacks in self.pending.items():
+            try:
+                shader=self.builder.getShader(renderState)
+            except AssertionError as e:
+                error=e
+                shader=None
+            for callback in callbacks:
+                callback(shader)
+        self.pending.clear()
+        if error is not None: raise error
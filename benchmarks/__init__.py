@@ -0,0 +1,12 @@
+"""
+
+Headless benchmarks for the shader generator.
+
+These generate synthetic libraries and scripts of configurable size (see synthetic.py),
+and time the main phases of loading and generating shaders (see run.py), writing the results as JSON
+so they can be compared across versions. If panda3d is not installed, a minimal stand-in is used (see pandaStub.py).
+
+Run from the root of the repository:
+    python -m benchmarks.run --nodes 200 --depth 10 --features 8 --out bench.json
+
+"""
@@ -0,0 +1,69 @@
+import sys
+import types
+import os
+
+"""
+
+A minimal stand-in for the parts of panda3d (and direct) used by the shader generator,
+so it can be benchmarked without Panda3D installed, or a window.
+
+Only enough is provided to load libraries and scripts, and generate shaders:
+Shader.make just keeps the source, and the attrib classes just have slots.
+
+"""
+
+class Shader(object):
+    SLCg=1
+    def __init__(self,source):
+        self.source=source
+    @staticmethod
+    def make(source,lang):
+        return Shader(source)
+
+class RenderAttrib(object):
+    slot=0
+    @classmethod
+    def getClassSlot(cls):
+        return cls.slot
+
+class ShaderAttrib(RenderAttrib):
+    slot=1
+    @staticmethod
+    def make():
+        return ShaderAttrib()
+    def getShaderInput(self,name):
+        return None
+
+class MaterialAttrib(RenderAttrib): slot=2
+class ColorAttrib(RenderAttrib): slot=3
+class TextureAttrib(RenderAttrib): slot=4
+
+def _module(name,**attribs):
+    m=types.ModuleType(name)
+    m.__dict__.update(attribs)
+    sys.modules[name]=m
+    return m
+
+def install(force=False):
+    """
+    makes the stand-in importable as panda3d.core etc. if panda3d is not available (or force is True)
+    returns True if the stand-in is used
+    """
+    if not force:
+        try:
+            import panda3d.core
+            return False
+        except ImportError:
+            pass
+    _module("panda3d",core=_module("panda3d.core",
+        Shader=Shader,
+        ShaderAttrib=ShaderAttrib,
+        MaterialAttrib=MaterialAttrib,
+        ColorAttrib=ColorAttrib,
+        TextureAttrib=TextureAttrib,
+        ))
+    _module("direct",
+        showbase=_module("direct.showbase",AppRunnerGlobal=_module("direct.showbase.AppRunnerGlobal",appRunner=None)),
+        stdpy=_module("direct.stdpy",file=_module("direct.stdpy.file",join=os.path.join)),
+        )
+    return True
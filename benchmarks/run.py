@@ -0,0 +1,133 @@
+"""
+
+Runs the benchmarks, and writes the results as JSON. See benchmarks/__init__.py
+
+Each phase is timed repeat times, and the fastest time is reported (in seconds), along with the time per item.
+Cold timings clear the relevant caches first, warm ones reuse them.
+
+"""
+
+import argparse
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+from benchmarks import pandaStub
+usingStub=pandaStub.install()
+
+import shaderBuilder
+from benchmarks import synthetic
+
+def timePhase(function,repeat,setup=None):
+    """ returns the fastest of repeat runs of function, calling setup (untimed) before each """
+    best=None
+    for i in xrange(repeat):
+        if setup is not None: setup()
+        start=timeit.default_timer()
+        function()
+        t=timeit.default_timer()-start
+        if best is None or t<best: best=t
+    return best
+
+def sampleRenderStates(builder,maxStates):
+    """ returns up to maxStates RenderStates spread over all combinations of the builder's features """
+    allStates=builder.setupRenderStateFactory().allRenderStates()
+    step=max(1,len(allStates)//maxStates)
+    return [allStates[i] for i in xrange(0,len(allStates),step)][:maxStates]
+
+def runBenchmarks(libPath,scriptPath,repeat=3,maxStates=256):
+    """
+    returns a dict with the number of RenderStates and distinct shaders generated,
+    and "timings": a dict mapping phase name to {"seconds":...,"items":...,"perItem":...}
+    """
+    timings={}
+    def record(name,seconds,items=1):
+        timings[name]={"seconds":seconds,"items":items,"perItem":seconds/max(1,items)}
+    
+    def clearFileCache(): shaderBuilder.libraryFileCache.clear()
+    def clearStageCache(): shaderBuilder.stageCache.clear()
+    
+    record("Library.loadPath cold",timePhase(lambda:shaderBuilder.Library([libPath]),repeat,clearFileCache))
+    record("Library.loadPath warm",timePhase(lambda:shaderBuilder.Library([libPath]),repeat))
+    
+    lib=shaderBuilder.Library([libPath])
+    record("Library._parseScript",timePhase(lambda:lib._parseScript(scriptPath),repeat))
+    
+    builder=lib.loadScript(scriptPath)
+    renderStates=sampleRenderStates(builder,maxStates)
+    items=len(renderStates)
+    
+    def makeActiveGraphs():
+        for renderState in renderStates:
+            shaderBuilder.makeActiveGraph(builder.nodes,renderState)
+    record("makeActiveGraph",timePhase(makeActiveGraphs,repeat),items)
+    record("makeActiveGraphs batch",timePhase(lambda:shaderBuilder.makeActiveGraphs(builder.nodes,renderStates),repeat),items)
+    
+    def makeStages():
+        for renderState in renderStates:
+            list(shaderBuilder.makeStages(builder.nodes,renderState))
+    record("makeStages cold",timePhase(makeStages,repeat,clearStageCache),items)
+    record("makeStages warm",timePhase(makeStages,repeat),items)
+    
+    stageKeys=shaderBuilder.stageCache.keys()
+    def makeStageFromActiveNodes():
+        for name,activeNodes in stageKeys:
+            shaderBuilder.makeStageFromActiveNodes(name,activeNodes)
+    record("makeStageFromActiveNodes cold",timePhase(makeStageFromActiveNodes,repeat,clearStageCache),len(stageKeys))
+    record("makeStageFromActiveNodes warm",timePhase(makeStageFromActiveNodes,repeat),len(stageKeys))
+    
+    builders=[]
+    def newBuilder():
+        clearStageCache()
+        builders[:]=[lib.loadScript(scriptPath)]
+    def getShaders():
+        for renderState in renderStates:
+            builders[0].getShader(renderState)
+    record("ShaderBuilder.getShader cold",timePhase(getShaders,repeat,newBuilder),items)
+    record("ShaderBuilder.getShader warm",timePhase(getShaders,repeat),items)
+    
+    return {
+        "renderStates":items,
+        "distinctShaders":len(builders[0].casheByStages),
+        "timings":timings,
+        }
+
+def main(args):
+    parser=argparse.ArgumentParser(prog="python -m benchmarks.run",description="benchmark the shader generator on a synthetic graph")
+    parser.add_argument("--nodes",type=int,default=100,help="number of code nodes in the script")
+    parser.add_argument("--depth",type=int,default=10,help="number of layers of code nodes")
+    parser.add_argument("--features",type=int,default=6,help="number of conditional features")
+    parser.add_argument("--types",type=int,default=None,help="number of node types in the library. Defaults to --nodes")
+    parser.add_argument("--states",type=int,default=256,help="maximum number of RenderStates to generate shaders for")
+    parser.add_argument("--repeat",type=int,default=3,help="number of times to run each phase")
+    parser.add_argument("--out",default=None,help="path to write the JSON results to. Defaults to stdout")
+    options=parser.parse_args(args)
+    
+    path=tempfile.mkdtemp(prefix="shaderBench")
+    try:
+        libPath,scriptPath=synthetic.makeBenchmark(path,options.nodes,options.depth,options.features,options.types)
+        results=runBenchmarks(libPath,scriptPath,options.repeat,options.states)
+    finally:
+        shutil.rmtree(path)
+    
+    report={
+        "parameters":vars(options),
+        "python":sys.version,
+        "platform":platform.platform(),
+        "pandaStub":usingStub,
+        "results":results,
+        }
+    text=json.dumps(report,indent=1,sort_keys=True)
+    if options.out is None:
+        print text
+    else:
+        f=open(options.out,'w')
+        f.write(text)
+        f.close()
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,127 @@
+import os
+
+"""
+
+Generates synthetic libraries and scripts for benchmarking.
+
+The library has a configurable number of simple code node types (spread over several files).
+
+The script builds a fragment shader from layers of code nodes: each node combines two outputs of the layer above.
+Conditional features (flags, tags, vertex columns and shader inputs, in rotation) each switch in an alternative
+path for one node, so the number of distinct shaders grows with the number of features.
+
+"""
+
+# how many node types to put in each library file
+typesPerFile=50
+
+# the kinds of conditional features, used in rotation
+featureKinds=("flag","tag","column","shaderInput")
+
+def nodeTypeName(i):
+    return "synth"+str(i)
+
+def writeLibrary(path,types):
+    """ writes a library folder to path with the requested number of node types """
+    if not os.path.isdir(path): os.makedirs(path)
+    
+    f=open(os.path.join(path,"project.txt"),'w')
+    f.write(""":: lib
+: code
+float4 synthScale(float4 v, float s){ return v*s; }
+
+:: node
+: info
+name synthProject
+: shaderinputs
+uniform float4x4 mat_modelproj
+: inlinks
+float4 vtx_position
+: outlinks
+float4 l_position
+: code
+l_position = mul(mat_modelproj, vtx_position);
+""")
+    f.close()
+    
+    for start in xrange(0,types,typesPerFile):
+        f=open(os.path.join(path,"synth"+str(start)+".txt"),'w')
+        for i in xrange(start,min(types,start+typesPerFile)):
+            f.write("""
+:: node
+: info
+name {name}
+: inlinks
+float4 a
+float4 b
+: outlinks
+float4 o
+: code
+o = synthScale(a,{i}) + b;
+""".format(name=nodeTypeName(i),i=i))
+        f.close()
+
+def featureNames(features):
+    """ returns a list of (kind,name) for the features used by a script with the requested number of them """
+    return [(featureKinds[j%len(featureKinds)],"synth"+str(j)) for j in xrange(features)]
+
+def writeScript(path,nodes,depth,features,types):
+    """
+    writes a script to path, using about nodes code nodes (of the first types synth node types)
+    in depth layers, with the requested number of conditional features
+    """
+    width=max(1,nodes//depth)
+    lines=[
+        "vertexPos=Input('float4 vtx_position : POSITION')",
+        "Output('vshader',synthProject(vertexPos),'float4 l_position : POSITION')",
+        ]
+    count=[0]
+    def codeNode(a,b):
+        name=nodeTypeName(count[0]%types)
+        count[0]+=1
+        return name+"("+a+","+b+")"
+    
+    prev=[]
+    for k in xrange(width):
+        lines.append("n_0_{k}=Constant('float4','float4({k},0,0,1)')".format(k=k))
+        prev.append("n_0_"+str(k))
+    
+    # maps layer to list of (kind,name,position in layer)
+    conditionals={}
+    for j,(kind,name) in enumerate(featureNames(features)):
+        conditionals.setdefault(1+j*depth//max(1,features),[]).append((kind,name,j%width))
+    
+    for d in xrange(1,depth+1):
+        layer=[]
+        for k in xrange(width):
+            v="n_{d}_{k}".format(d=d,k=k)
+            lines.append(v+"="+codeNode(prev[k],prev[(k+1)%width]))
+            layer.append(v)
+        for kind,name,k in conditionals.get(d,()):
+            v=layer[k]
+            if kind=="shaderInput":
+                lines.append("c_{name}=ConditionalInput('uniform float4 k_{name}')".format(name=name))
+            else:
+                predicate={"flag":"HasFlag","tag":"HasTag","column":"HasColumn"}[kind]
+                lines.append("c_{name}=ConditionalPassThrough({predicate}('{name}'),{v})".format(name=name,predicate=predicate,v=v))
+            lines.append("a_{name}=".format(name=name)+codeNode("c_"+name,v))
+            lines.append("{v}=FirstAvailable(a_{name},{v})".format(v=v,name=name))
+        prev=layer
+    
+    lines.append("Output('fshader',Operator(True,'+',"+",".join(prev)+"),'float4 o_color : COLOR')")
+    
+    f=open(path,'w')
+    f.write("\n".join(lines)+"\n")
+    f.close()
+
+def makeBenchmark(path,nodes,depth,features,types=None):
+    """
+    writes a library and script into the folder at path, returns (library path,script path)
+    types defaults to nodes
+    """
+    if types is None: types=nodes
+    libPath=os.path.join(path,"library")
+    scriptPath=os.path.join(path,"synthetic.gen")
+    writeLibrary(libPath,types)
+    writeScript(scriptPath,nodes,depth,features,types)
+    return libPath,scriptPath
@@ -0,0 +1,99 @@
+"""
+
+A decision tree used to skip evaluating Generator Graphs.
+
+Evaluating a Generator Graph (see shaderBuilder.makeActiveGraph) walks every node in it,
+but the result only depends on the answers to the questions the nodes ask the RenderState
+(hasTag, hasFlag, hasShaderInput, hasGeomVertexDataColumns, hasRenderAttrib etc.).
+Since evaluation is deterministic, the sequence of questions asked, and the result,
+is fully determined by the answers. The tree records these sequences: its branches are
+questions, keyed by their answers, and its leaves are the results.
+
+Resolving a RenderState then only requires asking the handful of questions on its path.
+The tree is built lazily: when a RenderState follows a path that has not been seen before,
+the Generator Graph is evaluated normally (recording the questions asked) and the new path is added.
+
+This works with custom nodes and RenderState subclasses, as long as nodes only
+use the RenderState through its methods, and those methods return hashable values.
+
+"""
+
+class _Branch(object):
+    """ an internal node of the tree: a question (method name,args) and its children by answer """
+    __slots__=("query","children")
+    def __init__(self,query):
+        self.query=query
+        self.children={}
+
+class _Leaf(object):
+    __slots__=("value",)
+    def __init__(self,value):
+        self.value=value
+
+class _RecordingRenderState(object):
+    """
+    wraps a RenderState, recording the questions asked of it, and their answers.
+    Repeated questions are answered from the record, and not recorded again.
+    """
+    def __init__(self,renderState):
+        self._renderState=renderState
+        self._answers={}
+        self.queries=[]
+    def __getattr__(self,name):
+        method=getattr(self._renderState,name)
+        def query(*args):
+            q=(name,args)
+            if q in self._answers:
+                return self._answers[q]
+            answer=method(*args)
+            self._answers[q]=answer
+            self.queries.append((q,answer))
+            return answer
+        return query
+
+class DecisionTree(object):
+    """
+
+    Caches the results of evaluate(renderState), for a deterministic evaluate function
+    that only depends on renderState through its methods. See module docs.
+
+    """
+    def __init__(self,evaluate):
+        self.evaluate=evaluate
+        self.root=None
+        # number of times evaluate has been called (number of distinct paths, not including failures)
+        self.evaluations=0
+
+    def clear(self):
+        self.root=None
+
+    def get(self,renderState):
+        """ returns evaluate(renderState), evaluating only when the path for renderState is new """
+        node=self.root
+        parent=None
+        answer=None
+        depth=0
+        while node is not None:
+            if isinstance(node,_Leaf): return node.value
+            name,args=node.query
+            answer=getattr(renderState,name)(*args)
+            parent=node
+            node=node.children.get(answer)
+            depth+=1
+
+        recorder=_RecordingRenderState(renderState)
+        value=self.evaluate(recorder)
+        self.evaluations+=1
+
+        # the first depth queries are the path already in the tree, the rest are new
+        assert len(recorder.queries)>=depth, "evaluate is not deterministic"
+        newNode=_Leaf(value)
+        for query,queryAnswer in reversed(recorder.queries[depth:]):
+            branch=_Branch(query)
+            branch.children[queryAnswer]=newNode
+            newNode=branch
+        if parent is None:
+            self.root=newNode
+        else:
+            parent.children[answer]=newNode
+        return value
@@ -0,0 +1,91 @@
+import os
+
+"""
+
+Hot reloading of libraries and scripts.
+
+A Watcher polls the files of a Library, and the scripts of ShaderBuilders loaded from it, for changes.
+When they change, it updates the builders (see Library.reloadScript). When only node types in library files changed,
+only the cached shaders whose active graphs used those node types are discarded, so regenerating
+shaders for a scene (ex: with manager.Manager.genShaders) after a small edit is fast.
+
+Polling (rather than something platform specific like inotify) is used, so it works everywhere.
+Each poll only lists the library folders, and stats the files.
+
+"""
+
+def _stamp(path):
+    """ returns something that changes when the file at path does (or None if it does not exist) """
+    try:
+        st=os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime,st.st_size)
+
+class Watcher(object):
+    """
+    
+    Watches a Library, and ShaderBuilders loaded from it with Library.loadScript, for changes.
+    
+    Call poll regularly to check for and apply changes, for example from a task (see pollTask).
+    
+    """
+    def __init__(self,library,builders=()):
+        self.library=library
+        self.libStamps=self._getLibStamps()
+        # maps builder to the stamp of its script
+        self.builders={}
+        for builder in builders: self.addBuilder(builder)
+    
+    def addBuilder(self,builder):
+        assert builder.scriptPath is not None, "builder must be made with Library.loadScript"
+        self.builders[builder]=_stamp(builder.scriptPath)
+    
+    def removeBuilder(self,builder):
+        del self.builders[builder]
+    
+    def _getLibStamps(self):
+        stamps={}
+        for path in self.library.paths:
+            for root, dirs, files in os.walk(path):
+                for name in files:
+                    if os.path.splitext(name)[1]==".txt":
+                        filePath=os.path.join(root, name)
+                        stamps[filePath]=_stamp(filePath)
+        return stamps
+    
+    def poll(self):
+        """
+        checks for changes, and updates the library and builders as needed.
+        returns the list of builders that were updated
+        """
+        changedNodeTypes=set()
+        libSourceChanged=False
+        
+        libStamps=self._getLibStamps()
+        if libStamps!=self.libStamps:
+            self.libStamps=libStamps
+            oldLibSource=self.library.libSource
+            changedNodeTypes=self.library.reload()
+            libSourceChanged=self.library.libSource!=oldLibSource
+        
+        updated=[]
+        for builder,oldStamp in self.builders.items():
+            stamp=_stamp(builder.scriptPath)
+            if stamp!=oldStamp or libSourceChanged:
+                self.builders[builder]=stamp
+                self.library.reloadScript(builder)
+            elif changedNodeTypes:
+                self.library.reloadScript(builder,changedNodeTypes)
+            else:
+                continue
+            updated.append(builder)
+        return updated
+    
+    def pollTask(self,task):
+        """
+        a Panda3D task that polls. Use with doMethodLater to set how often, for example:
+        taskMgr.doMethodLater(0.5,watcher.pollTask,"shaderWatcher")
+        """
+        self.poll()
+        return task.again
@@ -0,0 +1,85 @@
+import re
+
+"""
+
+The lib code from library files (":: lib" sections), indexed so shaders only include the parts they use.
+
+Each lib section is a LibBlock. Its exports are the names it declares at the top level
+(functions, structs, global variables and constants), and its uses are all the other identifiers in it.
+A shader includes the blocks that export an identifier its stages reference, and (recursively)
+the blocks those reference. Blocks that export nothing (such as comments) are included in every shader,
+since there is no way to tell what they are for.
+
+The scanning is purely lexical, so it can include a block that is not really needed
+(for example, if a local variable shares a name with an exported function), but it should never leave out one that is.
+
+"""
+
+_comment=re.compile(r"//[^\n]*|/\*.*?\*/",re.DOTALL)
+_identifier=re.compile(r"[A-Za-z_]\w*")
+_token=re.compile(r"[A-Za-z_]\w*|[{}()\[\];=:,]")
+
+# tokens that, following an identifier at the top level of a block, mean it is being declared
+_declarationEnds=frozenset(("(",";","=","[","{",":",","))
+
+def findIdentifiers(code):
+    """ returns the set of identifiers in code (not including those in comments) """
+    return set(_identifier.findall(_comment.sub(" ",code)))
+
+def findExports(code):
+    """ returns the set of identifiers declared at the top level of code """
+    exports=set()
+    depth=0
+    tokens=_token.findall(_comment.sub(" ",code))
+    for i,t in enumerate(tokens):
+        if t in ("{","("):
+            depth+=1
+        elif t in ("}",")"):
+            depth-=1
+        elif depth==0 and i+1<len(tokens) and tokens[i+1] in _declarationEnds and _identifier.match(t):
+            exports.add(t)
+    return exports
+
+class LibBlock(object):
+    def __init__(self,code):
+        self.code=code
+        self.exports=frozenset(findExports(code))
+        self.uses=frozenset(findIdentifiers(code)-self.exports)
+
+class LibCode(object):
+    """
+
+    All the lib code used by a ShaderBuilder: a list of LibBlocks, in load order.
+
+    """
+    def __init__(self,blocks):
+        self.blocks=tuple(blocks)
+
+        # maps identifiers to the indexes of the blocks that export them
+        self.index={}
+        for i,block in enumerate(self.blocks):
+            for name in block.exports:
+                self.index.setdefault(name,[]).append(i)
+
+        # the indexes of the blocks each block uses
+        self.dependencies=[self._findBlocks(block.uses) for block in self.blocks]
+
+        # blocks that are always included
+        self.always=[i for i,block in enumerate(self.blocks) if not block.exports]
+
+    def _findBlocks(self,identifiers):
+        return [i for name in identifiers for i in self.index.get(name,())]
+
+    def getSource(self,code=None):
+        """ returns the lib code needed by code, or all of it if code is None """
+        if code is None:
+            return "\n".join(block.code for block in self.blocks)
+
+        needed=set(self.always)
+        pending=self._findBlocks(findIdentifiers(code))
+        while pending:
+            i=pending.pop()
+            if i not in needed:
+                needed.add(i)
+                pending.extend(self.dependencies[i])
+        return "\n".join(self.blocks[i].code for i in sorted(needed))
@@ -10,12 +10,14 @@ For more advanced usage, the code here serves as an example.
 """
 from panda3d.core import ShaderAttrib
 import shaderBuilder
+import stats
+import background
 
-def getManager(libPaths,scriptPath,nodeTypeClassMap={},renderStateFactory=None,viewDebugScriptGraph=False,debugPath=None):
+def getManager(libPaths,scriptPath,nodeTypeClassMap={},renderStateFactory=None,viewDebugScriptGraph=False,debugPath=None,cachePath=None,track=False):
     """ a utility function to avoid having to make the library and builders for simple cases """
     lib=shaderBuilder.Library(libPaths,nodeTypeClassMap)
-    builder=lib.loadScript(scriptPath,viewGraph=viewDebugScriptGraph)
-    return Manager(builder,renderStateFactory,debugPath=debugPath)
+    builder=lib.loadScript(scriptPath,viewGraph=viewDebugScriptGraph,cachePath=cachePath)
+    return Manager(builder,renderStateFactory,debugPath=debugPath,track=track)
 
 # a helper
 def _getShaderAtrib(renderState):
@@ -25,38 +27,345 @@ def _getShaderAtrib(renderState):
     return shaderAtrib
 
 
+def _applyShader(geomNode,index,renderState,shader):
+    """ sets shader on the geom's state, renderState should be the geom's current state """
+    shaderAtrib=_getShaderAtrib(renderState)
+    shaderAtrib=shaderAtrib.setShader(shader)
+    geomNode.setGeomState(index,renderState.setAttrib(shaderAtrib))
+
+def _swapShader(geomNode,index,placeholder,shader):
+    """ replaces placeholder with shader on the geom, unless its shader has been changed since placeholder was applied """
+    renderState=geomNode.getGeomState(index)
+    if _getShaderAtrib(renderState).getShader()==placeholder:
+        _applyShader(geomNode,index,renderState,shader)
+
+def _restoreShader(geomNode,index,placeholder,oldRenderState):
+    """ puts back the ShaderAttrib from oldRenderState on the geom, unless its shader has been changed since placeholder was applied """
+    renderState=geomNode.getGeomState(index)
+    if _getShaderAtrib(renderState).getShader()==placeholder:
+        shaderAtrib=oldRenderState.getAttrib(ShaderAttrib.getClassSlot())
+        if shaderAtrib:
+            renderState=renderState.setAttrib(shaderAtrib)
+        else:
+            renderState=renderState.removeAttrib(ShaderAttrib.getClassSlot())
+        geomNode.setGeomState(index,renderState)
 
 class Manager(object):
-    def __init__(self,builder,renderStateFactory=None,debugPath=None,flags=()):
+    def __init__(self,builder,renderStateFactory=None,debugPath=None,flags=(),track=False):
+        """
+        if track is True, the manager remembers the RenderState each geom's shader was assigned for, so refresh can be used.
+        This keeps the GeomNodes alive until they are passed to forget.
+        """
         self.builder=builder
         self.renderStateFactory=builder.setupRenderStateFactory(renderStateFactory)
         self.debugPath=debugPath
         self.flags=set(flags)
-    def makeShader(self,pandaNode,pandaRenderState=None,geomVertexFormat=None,debugCodePrefix=None,debugGraphPrefix=None,extraFlags=()):
-        """ generate and return (but not apply) a shader """
-        genRenderState=self.renderStateFactory.getRenderState(pandaNode,pandaRenderState,geomVertexFormat,self.flags|set(extraFlags))
+        # see setPlaceholder
+        self.placeholder=None
+        self.background=None
+        # maps (GeomNode,geom index) to the RenderState whose shader is being generated for it, for the geoms with placeholders
+        self.waiting={}
+        # if tracking, maps GeomNode to a dict of geom index to the RenderState its shader was last assigned for. See refresh
+        self.assigned={} if track else None
+    
+    def setPlaceholder(self,placeholderBuilder):
+        """
+        
+        Makes genShaders (and genShadersJob) non blocking: geoms whose shaders are not cached get a shader from
+        placeholderBuilder (which should be made from a small script, such as graph/basic.gen) right away,
+        and their real shaders are generated on a worker thread (see background.py).
+        They are swapped in by poll (or pollTask), which must be called regularly.
+        
+        Placeholders are not waited for either: if one is not cached and the worker is busy generating,
+        the geom keeps the shader it had until its real shader is ready.
+        If the generator graph rejects a geom's RenderState, poll puts back the shader the geom had, and raises the error.
+        
+        The debug options of genShaders are ignored for shaders generated on the worker thread.
+        Pass None to go back to generating shaders when they are needed. Changing the placeholder (or passing None)
+        first waits for the worker, and swaps in the real shaders for all the geoms that still have placeholders.
+        
+        """
+        if self.background is not None:
+            # finish the shaders still being generated, so no geoms are left with placeholders
+            worker=self.background
+            self.background=None
+            worker.finish()
+        self.placeholder=None
+        if placeholderBuilder is not None:
+            self.placeholder=Manager(placeholderBuilder,flags=self.flags)
+            self.background=background.BackgroundBuilder(self.builder)
+    
+    def poll(self):
+        """ applies the shaders finished on the worker thread (see setPlaceholder). returns the number completed """
+        if self.background is None: return 0
+        return self.background.poll()
+    
+    def pollTask(self,task):
+        """
+        a Panda3D task that polls every frame, for example:
+        taskMgr.add(manager.pollTask,"shaderManager")
+        """
+        self.poll()
+        return task.cont
+    
+    def getRenderState(self,pandaNode,pandaRenderState=None,geomVertexFormat=None,extraFlags=(),tagDict=None):
+        """
+        returns the RenderState (see renderState.RenderState) used to generate shaders.
+        tagDict is passed on to RenderStateFactory.getRenderState
+        """
+        t=stats.shared.start()
+        renderState=self.renderStateFactory.getRenderState(pandaNode,pandaRenderState,geomVertexFormat,self.flags|set(extraFlags),tagDict)
+        stats.shared.stop("RenderStateFactory.getRenderState",t)
+        return renderState
+    
+    def getStats(self):
+        """
+        returns a snapshot of the statistics for this manager's builder (see ShaderBuilder.getStats),
+        which also includes the time spent in RenderStateFactory.getRenderState, and its memo's statistics
+        """
+        result=self.builder.getStats()
+        result["caches"]["renderStateMemo"]=self.renderStateFactory.memo.getStats()
+        return result
+    
+    def resetStats(self):
+        self.builder.resetStats()
+        self.renderStateFactory.memo.resetStats()
+    
+    def makeShader(self,pandaNode,pandaRenderState=None,geomVertexFormat=None,debugCodePrefix=None,debugGraphPrefix=None,extraFlags=(),tagDict=None,wait=True):
+        """ generate and return (but not apply) a shader. See ShaderBuilder.getShader for wait """
+        genRenderState=self.getRenderState(pandaNode,pandaRenderState,geomVertexFormat,extraFlags,tagDict)
+        return self._getShader(genRenderState,debugCodePrefix,debugGraphPrefix,wait)
+    
+    def _getShader(self,genRenderState,debugCodePrefix=None,debugGraphPrefix=None,wait=True):
         debugPath=None
         debugGraphPath=None
         if self.debugPath is not None:
             if debugCodePrefix is not None: debugPath=self.debugPath+debugCodePrefix
             if debugGraphPrefix is not None: debugGraphPath=self.debugPath+debugGraphPrefix
-        return self.builder.getShader(genRenderState,debugPath,debugGraphPath=debugGraphPath)
-    
-    def genShaders(self,node,debugCodePrefix=None,debugGraphPrefix=None):
-        """ walk all geoms and apply generateed shaders for them """
-        nn=node.node()
-        if nn.isGeomNode():
-            for i,renderState in enumerate(nn.getGeomStates()):
-                geomVertexFormat=nn.getGeom(i).getVertexData().getFormat()
-    
-                # TODO : the order of composing might be wrong!
-                netRs=renderState.compose(node.getNetState())
-    
-                shader=self.makeShader(node,netRs,geomVertexFormat,debugCodePrefix=debugCodePrefix,debugGraphPrefix=debugGraphPrefix)
-                shaderAtrib=_getShaderAtrib(renderState)
-                shaderAtrib=shaderAtrib.setShader(shader)
-                renderState=renderState.setAttrib(shaderAtrib)
-                nn.setGeomState(i,renderState)
-        
-        for n in node.getChildren():
-            self.genShaders(n,debugCodePrefix,debugGraphPrefix)
\ No newline at end of file
+        return self.builder.getShader(genRenderState,debugPath,debugGraphPath=debugGraphPath,wait=wait)
+    
+    def genShaders(self,node,debugCodePrefix=None,debugGraphPrefix=None,parallel=False,processes=None):
+        """
+        walk all geoms and apply generateed shaders for them
+        
+        Instanced GeomNodes only get the shader for their first instance, see _iterGeoms
+        
+        if parallel is True, the RenderStates for all the geoms are collected first, and the shaders for them
+        are generated on a pool of processes (see ShaderBuilder.getShaders). The debug options are ignored in this mode.
+        """
+        if parallel:
+            geoms=[]
+            self._collectGeoms(node,geoms)
+            shaders=self.builder.getShaders([genRenderState for nn,i,renderState,genRenderState in geoms],processes)
+            for (nn,i,renderState,genRenderState),shader in zip(geoms,shaders):
+                self._assign(nn,i,genRenderState)
+                self.waiting.pop((nn,i),None)
+                _applyShader(nn,i,renderState,shader)
+            return
+        
+        for geom in self._iterGeoms(node):
+            self._genShader(geom,debugCodePrefix,debugGraphPrefix)
+    
+    def refresh(self,node,debugCodePrefix=None,debugGraphPrefix=None):
+        """
+        
+        reapplies shaders to the geoms under node whose RenderStates (the features the generator graph uses)
+        have changed since their shaders were last assigned by this manager, for example after changing
+        a tag, texture or flag (see self.flags). Other geoms are left alone.
+        
+        The RenderStates for all the geoms under node are still found, but that is cheap compared to
+        generating and applying shaders. Geoms that have not had shaders assigned yet get them.
+        
+        returns the number of geoms that were reassigned. Requires tracking (see __init__)
+        
+        """
+        assert self.assigned is not None, "refresh requires a Manager made with track=True"
+        count=0
+        for geom in self._iterGeoms(node):
+            if self._genShader(geom,debugCodePrefix,debugGraphPrefix,onlyChanged=True): count+=1
+        return count
+    
+    def forget(self,node):
+        """
+        discards what this manager remembers (see refresh) about the GeomNodes under node.
+        Call when removing them from the scene for good, so they can be freed.
+        """
+        if self.assigned is None: return
+        for np,nn,i,renderState,netRs,tagDict in self._iterGeoms(node):
+            self.assigned.pop(nn,None)
+    
+    def _assign(self,nn,i,genRenderState,onlyChanged=False):
+        """
+        records that the geom is being assigned the shader for genRenderState, if tracking.
+        returns False (without recording anything) if onlyChanged and it already was
+        """
+        if self.assigned is None: return True
+        # RenderStates are interned, so identity is equality
+        assigned=self.assigned.setdefault(nn,{})
+        if onlyChanged and assigned.get(i) is genRenderState: return False
+        assigned[i]=genRenderState
+        return True
+    
+    def _genShader(self,geom,debugCodePrefix,debugGraphPrefix,onlyChanged=False):
+        """
+        applies the shader for a geom (as yielded by _iterGeoms), or a placeholder for it (see setPlaceholder).
+        If onlyChanged, geoms whose RenderState is the one they were last assigned for are skipped.
+        returns True if a shader was applied
+        """
+        node,nn,i,renderState,netRs,tagDict=geom
+        geomVertexFormat=nn.getGeom(i).getVertexData().getFormat()
+        genRenderState=self.getRenderState(node,netRs,geomVertexFormat,tagDict=tagDict)
+        
+        if not self._assign(nn,i,genRenderState,onlyChanged): return False
+        key=(nn,i)
+        
+        if self.background is None:
+            self.waiting.pop(key,None)
+            shader=self._getShader(genRenderState,debugCodePrefix,debugGraphPrefix)
+            _applyShader(nn,i,renderState,shader)
+            return True
+        
+        # swap is only called (from poll) after placeholder is set below
+        placeholder=None
+        def swap(shader):
+            # skip if the geom has been reassigned to a different RenderState in the mean time
+            if self.waiting.get(key) is genRenderState:
+                del self.waiting[key]
+                if shader is None:
+                    # the generator graph rejected genRenderState (poll raises the error)
+                    _restoreShader(nn,i,placeholder,renderState)
+                else:
+                    _swapShader(nn,i,placeholder,shader)
+        shader=self.background.getShader(genRenderState,swap)
+        if shader is not None:
+            self.waiting.pop(key,None)
+            _applyShader(nn,i,renderState,shader)
+            return True
+        
+        self.waiting[key]=genRenderState
+        placeholder=self.placeholder.makeShader(node,netRs,geomVertexFormat,wait=False)
+        if placeholder is None:
+            # the worker is generating, so the placeholder would have to wait for it too: leave the current shader
+            placeholder=_getShaderAtrib(renderState).getShader()
+        else:
+            _applyShader(nn,i,renderState,placeholder)
+        return True
+    
+    def genShadersJob(self,node,budget=0.002,callback=None,debugCodePrefix=None,debugGraphPrefix=None):
+        """
+        returns a GenShadersJob that applies generated shaders to all the geoms under node incrementally,
+        spending about budget seconds per step (frame). Run it as a Panda3D task with:
+            taskMgr.add(manager.genShadersJob(node).task,"genShaders")
+        callback(job) is called after each step, see GenShadersJob.
+        """
+        return GenShadersJob(self,node,budget,callback,debugCodePrefix,debugGraphPrefix)
+    
+    def _iterGeoms(self,node):
+        """
+        
+        yields (nodePath,geomNode,geom index,geom's panda3d.RenderState,net panda3d.RenderState,tag dict)
+        for all geoms under node, in depth first order.
+        
+        The net state and watched tags (see RenderStateFactory.getTagDict) are carried down from parent to child,
+        rather than looked up (walking up to the root) for each node.
+        
+        A GeomNode's states are shared by all its instances, so an instanced GeomNode is only yielded
+        for the first path it is found by.
+        
+        This is lazy: nodes are only visited, and their states read, as the geoms are asked for
+        (so GenShadersJob can spread the traversal over several frames too).
+        
+        """
+        seen=set()
+        # (nodePath,parent's net state,parent's tag dict). The parent's are None for node itself
+        stack=[(node,None,None)]
+        while stack:
+            np,parentState,parentTags=stack.pop()
+            if parentState is None:
+                netState=np.getNetState()
+            else:
+                netState=parentState.compose(np.getState())
+            tagDict=self.renderStateFactory.getTagDict(np,parentTags)
+            
+            nn=np.node()
+            if nn.isGeomNode() and nn not in seen:
+                seen.add(nn)
+                for i in xrange(nn.getNumGeoms()):
+                    renderState=nn.getGeomState(i)
+                    # TODO : the order of composing might be wrong!
+                    netRs=renderState.compose(netState)
+                    yield np,nn,i,renderState,netRs,tagDict
+            
+            children=list(np.getChildren())
+            children.reverse()
+            for n in children:
+                stack.append((n,netState,tagDict))
+    
+    def _countGeoms(self,node):
+        """
+        returns the number of geoms _iterGeoms(node) yields (unless the scene graph changes in the mean time).
+        This only looks at the GeomNodes (found by Panda3D, without visiting the other nodes in python), so it is quick.
+        """
+        seen=set()
+        count=0
+        for np in [node]+list(node.findAllMatches("**/+GeomNode")):
+            nn=np.node()
+            if nn.isGeomNode() and nn not in seen:
+                seen.add(nn)
+                count+=nn.getNumGeoms()
+        return count
+    
+    def _collectGeoms(self,node,geoms):
+        """ appends (geomNode,geom index,geom's panda3d.RenderState,RenderState) to geoms for all geoms under node """
+        for np,nn,i,renderState,netRs,tagDict in self._iterGeoms(node):
+            geomVertexFormat=nn.getGeom(i).getVertexData().getFormat()
+            geoms.append((nn,i,renderState,self.getRenderState(np,netRs,geomVertexFormat,tagDict=tagDict)))
+
+class GenShadersJob(object):
+    """
+    
+    Applies generated shaders to the geoms under a node (like Manager.genShaders) a few at a time,
+    so shader generation for streamed in content can be spread over several frames instead of causing a hitch.
+    
+    Each call to step processes geoms until budget seconds have passed (at least one geom is always processed),
+    so a single slow shader can still exceed the budget.
+    
+    Progress is available as processed (the number of geoms done so far) out of total (the number of geoms),
+    and done is True once all are done. If provided, callback(job) is called after each step, including the last one.
+    
+    The scene graph is traversed as the job goes (see Manager._iterGeoms), and each geom's state is read
+    just before its shader is applied. total is counted up front with a quick pass over just the GeomNodes
+    (see Manager._countGeoms). If the scene graph changes while the job runs, it is corrected to processed when done.
+    Nodes added under a part of the tree that has already been traversed are not picked up.
+    
+    """
+    def __init__(self,manager,node,budget=0.002,callback=None,debugCodePrefix=None,debugGraphPrefix=None):
+        self.manager=manager
+        self.budget=budget
+        self.callback=callback
+        self.debugCodePrefix=debugCodePrefix
+        self.debugGraphPrefix=debugGraphPrefix
+        self.geoms=manager._iterGeoms(node)
+        self.total=manager._countGeoms(node)
+        self.processed=0
+        self.done=False
+    
+    def step(self):
+        """ processes geoms for up to budget seconds. Returns True once all the geoms are done """
+        endTime=stats.timer()+self.budget
+        while not self.done:
+            geom=next(self.geoms,None)
+            if geom is None:
+                self.done=True
+                self.total=self.processed
+                break
+            self.manager._genShader(geom,self.debugCodePrefix,self.debugGraphPrefix)
+            self.processed+=1
+            if stats.timer()>=endTime: break
+        if self.callback is not None: self.callback(self)
+        return self.done
+    
+    def task(self,task):
+        """ a Panda3D task that runs a step per frame until done, see Manager.genShadersJob """
+        if self.step(): return task.done
+        return task.cont
\ No newline at end of file
@@ -1,4 +1,5 @@
 import itertools
+import weakref
 import param
 
 from panda3d.core import MaterialAttrib,ColorAttrib,TextureAttrib
@@ -11,6 +12,17 @@ This module contains the basic NodeType implementation, including the classes it
 
 boolLinkType="MetaBool"
 
+# while a generator graph is being built, the list of Links made, see recordLinks
+_newLinks=None
+
+def recordLinks(links):
+    """
+    starts recording the Links made into the list links (or stops recording if links is None).
+    Used to find all the links in a generator graph while running its script, see FrozenGraph
+    """
+    global _newLinks
+    _newLinks=links
+
 class Link(object):
     """
     
@@ -22,6 +34,7 @@ class Link(object):
     def __init__(self,dataType,name="Unnamed"):
         self.dataType=dataType
         self.name=name
+        if _newLinks is not None: _newLinks.append(self)
     def getType(self): return self.dataType
     def getName(self): return self.name
     def __repr__(self):
@@ -43,17 +56,26 @@ class ActiveNode(object):
     This is important as they are hashed by pointer,
     and need to compare properly and quicky for the caching to work.
     
+    The cache only holds weak references, so instances no longer used anywhere are freed.
+    
     """
-    cache = {}
+    __slots__=("shaderInputs","inLinks","outLinks","code","outPut","stage","comment","nodeType","__weakref__")
     
-    def __new__(cls, *v):
+    cache = weakref.WeakValueDictionary()
+    
+    def __new__(cls,shaderInputs,inLinks,outLinks,code,isOutPut,comment="",stage=None,nodeType=None):
+        # key on all the arguments, so instances made with and without the defaults (or by unpickling) are shared
+        v=(shaderInputs,inLinks,outLinks,code,isOutPut,comment,stage,nodeType)
         o = cls.cache.get(v, None)
         if o:
             return o
         else:
             o = cls.cache[v] = object.__new__(cls)
             return o
-    def __init__(self,shaderInputs,inLinks,outLinks,code,isOutPut,comment="",stage=None):
+    def __reduce__(self):
+        # unpickle through the cache, to keep them flyweights
+        return ActiveNode,(self.shaderInputs,self.inLinks,self.outLinks,self.code,self.outPut,self.comment,self.stage,self.nodeType)
+    def __init__(self,shaderInputs,inLinks,outLinks,code,isOutPut,comment="",stage=None,nodeType=None):
         self.shaderInputs=shaderInputs
         self.inLinks=inLinks
         self.outLinks=outLinks
@@ -62,6 +84,8 @@ class ActiveNode(object):
         if isOutPut: assert stage is not None
         self.stage=stage
         self.comment=comment
+        # name of the library node type this came from, if any. Used to find what to discard when it changes
+        self.nodeType=nodeType
     def getShaderInputs(self): return self.shaderInputs
     def getInLinks(self): return self.inLinks
     def getOutLinks(self): return self.outLinks
@@ -81,8 +105,14 @@ class ActiveOutput(object):
     This is important as they are hashed by pointer,
     and need to compare properly and quicky for the caching to work.
     
+    The cache only holds weak references, so instances no longer used anywhere are freed.
+    
     """
-    cache = {}
+    __slots__=("shaderOutput","inLink","stage","__weakref__")
+    
+    cache = weakref.WeakValueDictionary()
+    
+    nodeType=None
     
     def __new__(cls, *v):
         o = cls.cache.get(v, None)
@@ -91,6 +121,8 @@ class ActiveOutput(object):
         else:
             o = cls.cache[v] = object.__new__(cls)
             return o
+    def __reduce__(self):
+        return ActiveOutput,(self.stage,self.inLink,self.shaderOutput)
     def __init__(self,stage,inLink,shaderOutput):
         self.shaderOutput=shaderOutput
         self.inLink=inLink
@@ -121,6 +153,184 @@ def makeFullCode(code,shaderInputs,inLinks,outLinks):
 
     return "("+",".join(fparamChain)+"){\n"+code+"\n}"
     
+def _bits(mask):
+    """ yields the indexes of the set bits in mask """
+    while mask:
+        low=mask&-mask
+        yield low.bit_length()-1
+        mask^=low
+
+class Batch(object):
+    """
+    
+    The state for evaluating a generator graph for a list of RenderStates at once, see evaluateBatch.
+    
+    Link statuses are bit masks: bit i is the status for renderStates[i].
+    As a result, statuses in a Batch are booleans, so graphs with nodes that might use other values
+    are not evaluated in batches, see supportsBatch.
+    
+    """
+    def __init__(self,renderStates,links):
+        self.renderStates=renderStates
+        # mask with a bit for every RenderState
+        self.all=(1<<len(renderStates))-1
+        # the status mask for each link
+        self.linkStatus=dict.fromkeys(links,0)
+        # mask of the RenderStates the graph has rejected (by failing an assertion), and maps their indexes to the errors
+        self.failed=0
+        self.errors={}
+    
+    def where(self,test):
+        """ returns the mask of the RenderStates for which test(renderState) is true """
+        mask=0
+        for i,renderState in enumerate(self.renderStates):
+            if test(renderState): mask|=1<<i
+        return mask
+    
+    def allActive(self,links):
+        """ returns the mask of the RenderStates for which all of links are active """
+        mask=self.all
+        for link in links: mask&=self.linkStatus[link]
+        return mask
+    
+    def anyActive(self,links):
+        mask=0
+        for link in links: mask|=self.linkStatus[link]
+        return mask
+    
+    def fail(self,mask,error):
+        """ rejects the RenderStates in mask, with error (an AssertionError) """
+        for i in _bits(mask&~self.failed):
+            self.errors[i]=error
+        self.failed|=mask
+
+class _StateLinkStatus(object):
+    """ one RenderState's view of a Batch's link statuses, for use as the linkStatus passed to getActiveNodes """
+    def __init__(self,linkStatus,bit):
+        self.linkStatus=linkStatus
+        self.bit=bit
+    def __getitem__(self,link):
+        return bool(self.linkStatus[link]&self.bit)
+    def __setitem__(self,link,value):
+        if value:
+            self.linkStatus[link]|=self.bit
+        else:
+            self.linkStatus[link]&=~self.bit
+
+def _definingClass(cls,name):
+    """ returns the class in cls's mro that defines the attribute name """
+    for c in cls.__mro__:
+        if name in c.__dict__: return c
+    return None
+
+def supportsBatch(node):
+    """
+    
+    returns True if node's getActiveNodesBatch matches its getActiveNodes, so it can be used by evaluateBatch.
+    
+    That is not the case if getActiveNodes is overridden by a class that does not also override getActiveNodesBatch
+    (for example a custom node type, or a subclass of a built in one): the inherited getActiveNodesBatch would
+    ignore the override, or (for Node's) run it with boolean link statuses, which it might not expect.
+    
+    """
+    cls=type(node)
+    return issubclass(_definingClass(cls,"getActiveNodesBatch"),_definingClass(cls,"getActiveNodes"))
+
+class FrozenGraph(object):
+    """
+    
+    A generator graph: the list of nodes (in topological order) made by a script, and all the Links they made.
+    Knowing all the links up front lets each evaluation start from a copy of a prefilled link status dict,
+    rather than a defaultdict that calls back into python for every link it has not seen.
+    The Links themselves are not changed, so they (and the nodes) can be shared by several graphs.
+    
+    Iterating a FrozenGraph yields its nodes.
+    
+    """
+    def __init__(self,graphNodes,links):
+        self.nodes=tuple(graphNodes)
+        self.links=tuple(links)
+        # all links inactive, copied to start each evaluation
+        self.linkStatus=dict.fromkeys(self.links,False)
+        # False if any node can't be evaluated in batches, see supportsBatch and evaluateBatch
+        self.batchable=all(supportsBatch(n) for n in self.nodes)
+    def __iter__(self): return iter(self.nodes)
+    def __len__(self): return len(self.nodes)
+    
+    def evaluate(self,renderState):
+        """ returns the list of active nodes for renderState, see shaderBuilder.makeActiveGraph """
+        # linksStatus starts false for all links.
+        linkStatus=dict(self.linkStatus)
+        sortedActive=[]
+        for n in self.nodes:
+            sortedActive.extend(n.getActiveNodes(renderState,linkStatus))
+        return sortedActive
+
+def _findLinks(value,links,seen):
+    """ appends the Links in value (a Link, Node, ActiveNode or ActiveOutput, or a container of them) not in seen to links """
+    if id(value) in seen: return
+    if isinstance(value,Link):
+        seen.add(id(value))
+        links.append(value)
+    elif isinstance(value,(list,tuple,set,frozenset)):
+        seen.add(id(value))
+        for v in value: _findLinks(v,links,seen)
+    elif isinstance(value,dict):
+        seen.add(id(value))
+        for v in value.itervalues(): _findLinks(v,links,seen)
+    elif isinstance(value,Node):
+        seen.add(id(value))
+        _findLinks(value.__dict__,links,seen)
+    elif isinstance(value,(ActiveNode,ActiveOutput)):
+        seen.add(id(value))
+        _findLinks(value.getInLinks(),links,seen)
+        _findLinks(value.getOutLinks(),links,seen)
+
+def freeze(graphNodes):
+    """
+    
+    returns graphNodes as a FrozenGraph. graphNodes may already be one, otherwise it should be a list of nodes
+    (in topological order), and the Links are found by searching the nodes' attributes (including lists, tuples, dicts
+    and ActiveNodes in them). Scripts loaded by a Library record their links as they are made instead, see recordLinks
+    
+    """
+    if isinstance(graphNodes,FrozenGraph): return graphNodes
+    links=[]
+    seen=set()
+    for n in graphNodes: _findLinks(n,links,seen)
+    return FrozenGraph(graphNodes,links)
+
+def evaluateBatch(graph,renderStates):
+    """
+    
+    evaluates graph (a FrozenGraph) for all of renderStates at once.
+    Each node's getActiveNodesBatch is called once for the whole batch.
+    If the graph has nodes that don't support that (see supportsBatch),
+    it is evaluated for each RenderState in turn instead, so the results are always the same as FrozenGraph.evaluate.
+    
+    returns a list with, for each RenderState, either its list of active nodes (like shaderBuilder.makeActiveGraph),
+    or the AssertionError if the graph rejected it
+    
+    """
+    if not graph.batchable:
+        result=[]
+        for renderState in renderStates:
+            try:
+                result.append(graph.evaluate(renderState))
+            except AssertionError as e:
+                result.append(e)
+        return result
+    
+    batch=Batch(renderStates,graph.links)
+    activeNodes=[[] for renderState in renderStates]
+    for n in graph:
+        for activeNode,mask in n.getActiveNodesBatch(batch):
+            for i in _bits(mask):
+                activeNodes[i].append(activeNode)
+    for i in _bits(batch.failed):
+        activeNodes[i]=batch.errors[i]
+    return activeNodes
+
 class Node(object):
     """
     base class for all nodes, if used directly, takes no inputs, has no
@@ -132,6 +342,27 @@ class Node(object):
         pass
     def getActiveNodes(self,renderState,linkStatus):
         return ()
+    def getActiveNodesBatch(self,batch):
+        """
+        
+        getActiveNodes for all of batch.renderStates at once (see Batch).
+        returns a list of (activeNode,mask) where mask has the bits of the RenderStates activeNode is active for.
+        
+        This calls getActiveNodes for each RenderState. Graphs with nodes that override getActiveNodes
+        but not this are not evaluated in batches, see supportsBatch.
+        
+        """
+        result=[]
+        for i,renderState in enumerate(batch.renderStates):
+            bit=1<<i
+            if batch.failed&bit: continue
+            try:
+                activeNodes=self.getActiveNodes(renderState,_StateLinkStatus(batch.linkStatus,bit))
+            except AssertionError as e:
+                batch.fail(bit,e)
+                continue
+            result.extend((a,bit) for a in activeNodes)
+        return result
     def setupRenderStateFactory(self,renderStateFactory):
         pass
 
@@ -168,7 +399,9 @@ class ScriptNode(Node):
     
 
 def allActive(linkStatus,links):
-    return all(linkStatus[link] for link in links)
+    for link in links:
+        if not linkStatus[link]: return False
+    return True
         
 class LinksNode(ScriptNode):
     def __init__(self,*inLinks):
@@ -180,6 +413,12 @@ class AssertActiveNode(LinksNode):
     def getActiveNodes(self,renderState,linkStatus):
         assert allActive(linkStatus,self.links), "{0}: links:{1}".format(self,[link for link in self.links if not linkStatus[link]])
         return ()
+    def getActiveNodesBatch(self,batch):
+        bad=batch.all&~batch.allActive(self.links)
+        if bad:
+            bit=bad&-bad
+            batch.fail(bad,AssertionError("{0}: links:{1}".format(self,[link for link in self.links if not batch.linkStatus[link]&bit])))
+        return ()
         
 class AllActiveNode(LinksNode):
     def __init__(self,activeNode,*inLinks):
@@ -192,14 +431,26 @@ class AllActiveNode(LinksNode):
             return (self.activeNode,)
         else:
             return ()
-        
+    def getActiveNodesBatch(self,batch):
+        mask=batch.allActive(self.links)
+        if not mask: return ()
+        for link in self.activeNode.outLinks:
+            batch.linkStatus[link]|=mask
+        return ((self.activeNode,mask),)
+        
+def _restore(cls,state):
+    """ makes an instance of cls with state as its __dict__, without calling __init__. Used for unpickling """
+    o=object.__new__(cls)
+    o.__dict__.update(state)
+    return o
+
 class CodeNode(AllActiveNode):
     """
     base class for nodes that fixed contain arbitrary code
     """
-    def __init__(self,source,shaderInputs,inLinks,outLinks,isOutPut,stage=None,comment="CodeNode"):
+    def __init__(self,source,shaderInputs,inLinks,outLinks,isOutPut,stage=None,comment="CodeNode",nodeType=None):
         self.source=source
-        activeNode=ActiveNode(tuple(shaderInputs),tuple(inLinks),tuple(outLinks),self.source,isOutPut,comment,stage)
+        activeNode=ActiveNode(tuple(shaderInputs),tuple(inLinks),tuple(outLinks),self.source,isOutPut,comment,stage,nodeType)
         AllActiveNode.__init__(self,activeNode,*inLinks)
     def getLink(self,name):
         for link in self.activeNode.getOutLinks():
@@ -230,7 +481,12 @@ def metaCodeNode(name,source,shaderInputs,inLinks,outLinks,isOutPut=False,stage=
                 if t0!=t1:
                     raise LinkError("Error: mismatched type on inLinks. Got: "+t1+" expected: "+t0)
             newOutLinks=(Link(link.getType(),link.name) for link in outLinks)
-            CodeNode.__init__(self,fullSource,shaderInputs,inLinks_,newOutLinks,isOutPut,stage,"CodeNode: "+name)
+            CodeNode.__init__(self,fullSource,shaderInputs,inLinks_,newOutLinks,isOutPut,stage,"CodeNode: "+name,name)
+        def __reduce_ex__(self,protocol):
+            # this class is made on the fly, so it can't be pickled by name.
+            # It only differs from CodeNode in its __init__, so pickle as a CodeNode
+            if type(self) is CustomCodeNode: return _restore,(CodeNode,self.__dict__)
+            return CodeNode.__reduce_ex__(self,protocol)
             
     return CustomCodeNode
 
@@ -241,6 +497,15 @@ def makePassThroughCode(type,backwards=False):
     else:
         s="(in {0} input,out {0} ouput)"
     return s.format(type)+"{ouput=input;}"
+
+def isPassThrough(activeNode):
+    """
+    returns True if activeNode just copies its only input (an inLink or a shader input) to its only outLink
+    (its code was made by makePassThroughCode). StageBuilder replaces these with aliases instead of generating code for them.
+    """
+    if not isinstance(activeNode,ActiveNode) or len(activeNode.outLinks)!=1: return False
+    sources=activeNode.shaderInputs+activeNode.inLinks
+    return len(sources)==1 and activeNode.code==makePassThroughCode(sources[0].getType())
     
 class SingleOutputMixin(object):
     def __init__(self,outLink):
@@ -278,6 +543,14 @@ class Input(SingleOutputMixin,ScriptNode):
     def getActiveNodes(self,renderState,linkStatus):
         linkStatus[self.outLink] = True
         return (self.activeNode,)
+    
+    def getActiveNodesBatch(self,batch):
+        return self._activate(batch,batch.all)
+    
+    def _activate(self,batch,mask):
+        if not mask: return ()
+        batch.linkStatus[self.outLink]|=mask
+        return ((self.activeNode,mask),)
 
 
 @reg
@@ -291,6 +564,9 @@ class ConditionalInput(Input):
             return Input.getActiveNodes(self,renderState,linkStatus)
         else:
             return ()
+    
+    def getActiveNodesBatch(self,batch):
+        return self._activate(batch,batch.where(lambda renderState:renderState.hasShaderInput(self.inputName)))
             
     def setupRenderStateFactory(self,renderStateFactory):
         renderStateFactory.shaderInputs.add(self.inputName)
@@ -318,9 +594,23 @@ class FirstAvailable(SingleOutputMixin,LinksNode):
         for i,input in enumerate(self.links):
             if linkStatus[input]:
                 linkStatus[self.outLink] = True
-                return (ActiveNode((),(input,),(self.outLink,),self.source,False,
-                    "FirstAvailable: choose #"+str(i)+" (0-"+str(len(self.links)-1)+")"),)
+                return (self._makeActiveNode(i),)
         return ()
+    
+    def getActiveNodesBatch(self,batch):
+        result=[]
+        remaining=batch.all
+        for i,input in enumerate(self.links):
+            mask=batch.linkStatus[input]&remaining
+            if mask:
+                result.append((self._makeActiveNode(i),mask))
+                remaining&=~mask
+        batch.linkStatus[self.outLink]|=batch.all&~remaining
+        return result
+    
+    def _makeActiveNode(self,i):
+        return ActiveNode((),(self.links[i],),(self.outLink,),self.source,False,
+            "FirstAvailable: choose #"+str(i)+" (0-"+str(len(self.links)-1)+")")
 
 @reg
 class AllAvailable(SingleOutputMixin,LinksNode):
@@ -337,6 +627,10 @@ class AllAvailable(SingleOutputMixin,LinksNode):
             if not linkStatus[input]: return ()
         linkStatus[self.outLink] = True
         return ()
+    
+    def getActiveNodesBatch(self,batch):
+        batch.linkStatus[self.outLink]|=batch.allActive(self.links)
+        return ()
 
 @reg
 class AnyAvailable(SingleOutputMixin,LinksNode):
@@ -353,6 +647,10 @@ class AnyAvailable(SingleOutputMixin,LinksNode):
             if linkStatus[input]:
                 linkStatus[self.outLink] = True
         return ()
+    
+    def getActiveNodesBatch(self,batch):
+        batch.linkStatus[self.outLink]|=batch.anyActive(self.links)
+        return ()
 
 @reg
 class NoneAvailable(SingleOutputMixin,LinksNode):
@@ -369,6 +667,10 @@ class NoneAvailable(SingleOutputMixin,LinksNode):
             if linkStatus[input]: return ()
         linkStatus[self.outLink] = True
         return ()
+    
+    def getActiveNodesBatch(self,batch):
+        batch.linkStatus[self.outLink]|=batch.all&~batch.anyActive(self.links)
+        return ()
 
 @reg
 class HasTag(SingleOutputMixin,ScriptNode):
@@ -386,6 +688,10 @@ class HasTag(SingleOutputMixin,ScriptNode):
         if renderState.hasTag(self.tagName):
             linkStatus[self.outLink] = True
         return ()
+    
+    def getActiveNodesBatch(self,batch):
+        batch.linkStatus[self.outLink]|=batch.where(lambda renderState:renderState.hasTag(self.tagName))
+        return ()
             
     def setupRenderStateFactory(self,renderStateFactory):
         renderStateFactory.tags.add(self.tagName)
@@ -408,6 +714,10 @@ class HasFlag(SingleOutputMixin,ScriptNode):
         if renderState.hasFlag(self.flagName):
             linkStatus[self.outLink] = True
         return ()
+    
+    def getActiveNodesBatch(self,batch):
+        batch.linkStatus[self.outLink]|=batch.where(lambda renderState:renderState.hasFlag(self.flagName))
+        return ()
             
     def setupRenderStateFactory(self,renderStateFactory):
         renderStateFactory.flags.add(self.flagName)
@@ -432,6 +742,12 @@ class ConditionalPassThrough(SingleOutputMixin,ScriptNode):
             return (self.activeNode,)
         else:
             return ()
+    
+    def getActiveNodesBatch(self,batch):
+        mask=batch.linkStatus[self.conditionLink]&batch.all
+        if not mask: return ()
+        batch.linkStatus[self.outLink]|=mask
+        return ((self.activeNode,mask),)
 
 
 @reg
@@ -474,6 +790,26 @@ class Operator(SingleOutputMixin,LinksNode):
                 return (self.makeActiveNode(tuple(activeInputs)),)
             else:
                 return ()
+    
+    def getActiveNodesBatch(self,batch):
+        if self.requireAll:
+            mask=batch.allActive(self.links)
+            if not mask: return ()
+            batch.linkStatus[self.outLink]|=mask
+            return ((self.activeNode,mask),)
+        
+        # split the RenderStates into groups by which inputs are active
+        groups=[(batch.all,())]
+        for link in self.links:
+            status=batch.linkStatus[link]
+            split=[]
+            for mask,activeInputs in groups:
+                if mask&status: split.append((mask&status,activeInputs+(link,)))
+                if mask&~status: split.append((mask&~status,activeInputs))
+            groups=split
+        result=[(self.makeActiveNode(activeInputs),mask) for mask,activeInputs in groups if activeInputs]
+        batch.linkStatus[self.outLink]|=batch.anyActive(self.links)
+        return result
 
 @reg
 class Output(ScriptNode):
@@ -498,6 +834,16 @@ class Output(ScriptNode):
     def getActiveNodes(self,renderState,linkStatus):
         assert linkStatus[self.inlink], "Output node '{out}'' must have active input '{input}'".format(out=self.shaderInput.activeNode,input=self.inlink)
         return (self.activeNode,self.shaderInput.getActiveNodes(renderState,linkStatus)[0])
+    
+    def getActiveNodesBatch(self,batch):
+        bad=batch.all&~batch.linkStatus[self.inlink]
+        if bad:
+            batch.fail(bad,AssertionError("Output node '{out}'' must have active input '{input}'".format(out=self.shaderInput.activeNode,input=self.inlink)))
+        return self._activate(batch,batch.all)
+    
+    def _activate(self,batch,mask):
+        if not mask: return ()
+        return ((self.activeNode,mask),)+self.shaderInput._activate(batch,mask)
 
 @reg
 class ConditionalOutput(Output):
@@ -506,6 +852,9 @@ class ConditionalOutput(Output):
             return Output.getActiveNodes(self,renderState,linkStatus)
         else:
             return ()
+    
+    def getActiveNodesBatch(self,batch):
+        return self._activate(batch,batch.linkStatus[self.inlink]&batch.all)
 
 @reg
 class Constant(SingleOutputMixin,ScriptNode):
@@ -524,9 +873,20 @@ class Constant(SingleOutputMixin,ScriptNode):
     def getActiveNodes(self,renderState,linkStatus):
         linkStatus[self.outLink]=True
         return (self.activeNode,)
+    
+    def getActiveNodesBatch(self,batch):
+        batch.linkStatus[self.outLink]|=batch.all
+        return ((self.activeNode,batch.all),)
+
 
+# maps RenderAttrib class slot to its HasRenderAttrib class
+_hasRenderAttribClasses={}
+
+def _restoreHasRenderAttrib(slot,state):
+    return _restore(metaHasRenderAttrib(slot),state)
 
 def metaHasRenderAttrib(slot):
+    if slot in _hasRenderAttribClasses: return _hasRenderAttribClasses[slot]
     class HasRenderAttrib(SingleOutputMixin,ScriptNode):
         def __init__(self):
             ScriptNode.__init__(self)
@@ -537,9 +897,17 @@ def metaHasRenderAttrib(slot):
             if renderState.hasRenderAttrib(slot):
                 linkStatus[self.outLink] = True
             return ()
+        
+        def getActiveNodesBatch(self,batch):
+            batch.linkStatus[self.outLink]|=batch.where(lambda renderState:renderState.hasRenderAttrib(slot))
+            return ()
                 
         def setupRenderStateFactory(self,renderStateFactory):
             renderStateFactory.hasRenderAttribs.add(slot)
+        
+        def __reduce__(self):
+            return _restoreHasRenderAttrib,(slot,self.__dict__)
+    _hasRenderAttribClasses[slot]=HasRenderAttrib
     return HasRenderAttrib
     
 reg(metaHasRenderAttrib(MaterialAttrib.getClassSlot()),"HasMaterial")
@@ -559,6 +927,10 @@ class HasColumn(SingleOutputMixin,ScriptNode):
         if renderState.hasGeomVertexDataColumns(self.name):
             linkStatus[self.outLink] = True
         return ()
+    
+    def getActiveNodesBatch(self,batch):
+        batch.linkStatus[self.outLink]|=batch.where(lambda renderState:renderState.hasGeomVertexDataColumns(self.name))
+        return ()
             
     def setupRenderStateFactory(self,renderStateFactory):
         renderStateFactory.geomVertexDataColumns.add(self.name)
@@ -590,3 +962,12 @@ class Select(SingleOutputMixin,ScriptNode):
             linkStatus[self.outLink] = True
             return (self.activeNodes[source],)
         return ()
+    
+    def getActiveNodesBatch(self,batch):
+        condition=batch.linkStatus[self.conditionLink]
+        masks=(
+            condition&batch.linkStatus[self.dataLinks[0]]&batch.all,
+            ~condition&batch.linkStatus[self.dataLinks[1]]&batch.all,
+            )
+        batch.linkStatus[self.outLink]|=masks[0]|masks[1]
+        return [(activeNode,mask) for activeNode,mask in zip(self.activeNodes,masks) if mask]
@@ -0,0 +1,49 @@
+import os
+import multiprocessing
+
+"""
+
+Helpers for spreading shader generation over several processes.
+
+Generator graphs are built by running scripts, and contain classes made on the fly (see nodes.metaCodeNode)
+so they can't be pickled and sent to other processes. Instead, the work is set up before the worker processes
+are forked, so they inherit it, and only indexes and results are passed between processes.
+This means that the pool is only used on platforms that support fork. Elsewhere the work is done serially.
+
+"""
+
+# set by forkMap before forking worker processes, and inherited by them
+_job=None
+
+def _runJob(index):
+    function,items=_job
+    return function(items[index])
+
+def forkMap(function,items,processes=None):
+    """
+
+    returns map(function,items), computed using a pool of forked processes.
+
+    items must be a sequence (support len and indexing). function and items are not pickled,
+    so they can be anything, but the results of function must be picklable.
+
+    processes defaults to the number of cpus. If 1 (or fork is unsupported), everything is done in this process.
+
+    """
+    global _job
+    if processes is None: processes=multiprocessing.cpu_count()
+    count=len(items)
+    processes=min(processes,count)
+    if processes<=1 or not hasattr(os,"fork"):
+        return [function(items[i]) for i in xrange(count)]
+
+    _job=(function,items)
+    try:
+        pool=multiprocessing.Pool(processes)
+        try:
+            return pool.map(_runJob,xrange(count),max(1,count//(processes*4)))
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _job=None
@@ -33,22 +33,36 @@ def shaderParamFromDefCode(defCode):
     return ShaderParam(name,type,semantic)
 
 class Param(object):
+    """
+    
+    Params should not be modified after construction: their hash is computed once, as they are used in
+    the keys of the ActiveNode flyweight cache.
+    
+    """
+    __slots__=("name","type","_hash")
     def __init__(self,name,type):
         self.name=name
         self.type=type
+        self._hash=hash(name)^hash(type)
     def getName(self): return self.name
     def getType(self): return self.type
     def __repr__(self): return self.__class__.__name__+"("+self.name+", "+self.type+")"
     def __str__(self): return self.type+" "+self.name
     def __hash__(self):
-        return hash(self.name)^hash(self.type)
+        return self._hash
+    def __reduce__(self):
+        # recompute the hash when unpickling, since string hashes can differ between processes
+        return self.__class__,(self.name,self.type)
     def __eq__(self,other):
         return self.__class__==other.__class__ and self.name==other.name and self.type==other.type
         
 class ShaderParam(Param):
+    __slots__=("semantic",)
     def __init__(self,name,type,semantic=None):
         Param.__init__(self,name,type)
         self.semantic=semantic
+    def __reduce__(self):
+        return self.__class__,(self.name,self.type,self.semantic)
     def getSemantic(self): return self.semantic
     def getDefCode(self): return self.type+" "+self.name+((" : "+self.semantic) if self.semantic else "")
     def __eq__(self,other):
@@ -60,6 +74,6 @@ class ShaderParam(Param):
             return s+" : "+self.semantic
         else:
             return s
-class ShaderInput(ShaderParam): pass
-class ShaderOutput(ShaderParam): pass
+class ShaderInput(ShaderParam): __slots__=()
+class ShaderOutput(ShaderParam): __slots__=()
 
@@ -0,0 +1,91 @@
+"""
+
+Command line tool for generating all the shaders a script can produce ahead of time,
+so they can be shipped and nothing needs to be generated at runtime.
+
+Usage:
+    python -m shaderBuilder precompile graph/lit.gen --lib library --out shaderCache --tag material=wood --tag material=stone
+
+This enumerates every combination of the features the script's RenderStateFactory watches
+(see RenderStateFactory.allRenderStates) a chunk at a time, generates the ones with new active graphs
+on a pool of processes (see shaderBuilder.precompileStates), and writes each distinct shader to a shaderCache.DiskCache under the out path,
+along with a manifest.json listing the hash of each distinct shader and how many RenderStates use it.
+
+The cache is keyed on the values of tags, not just their presence, so pass each value the scene uses
+for the tags the script watches with --tag name=value (repeat it for more values, or tags).
+Tags without any values given are only enumerated with the empty string as their value.
+
+To use the results at runtime, pass the same out path as cachePath to Library.loadScript or manager.getManager.
+
+"""
+
+import argparse
+import json
+import os
+import time
+
+import shaderBuilder
+import shaderCache
+
+def parseTagValues(tags):
+    """ returns a dict mapping tag names to the list of their values, from a list of "name=value" strings """
+    tagValues={}
+    for tag in tags:
+        name,sep,value=tag.partition("=")
+        if not sep: raise ValueError("tags must be given as name=value, got: "+tag)
+        tagValues.setdefault(name,[]).append(value)
+    return tagValues
+
+def precompileScript(scriptPath,libPaths,outPath,processes=None,tagValues={}):
+    """
+    precompiles every shader for the script at scriptPath, see module docs.
+    tagValues maps tag names to the list of their values to enumerate, see RenderStateFactory.allRenderStates
+    returns the path to the written manifest
+    """
+    lib=shaderBuilder.Library(libPaths)
+    builder=lib.loadScript(scriptPath,cachePath=outPath)
+    factory=builder.setupRenderStateFactory()
+    renderStates=factory.allRenderStates(tagValues=tagValues)
+
+    print "Precompiling "+str(len(renderStates))+" RenderStates for "+scriptPath
+    startTime=time.time()
+    shaders,rejected=shaderBuilder.precompileStates(builder,renderStates,processes)
+    variants=len(shaders)
+    print "Generated "+str(variants)+" distinct shaders in "+str(time.time()-startTime)+" seconds"
+    if rejected: print "Skipped "+str(rejected)+" RenderStates rejected by the generator graph"
+
+    manifest={
+        "cacheVersion":shaderCache.cacheVersion,
+        "script":scriptPath,
+        "libraries":list(libPaths),
+        "features":factory.getFeatures(),
+        "tagValues":tagValues,
+        "variants":variants,
+        "renderStates":len(renderStates),
+        "rejected":rejected,
+        "shaders":shaders,
+        }
+    manifestPath=os.path.join(builder.diskCache.path,"manifest.json")
+    f=open(manifestPath,'w')
+    json.dump(manifest,f,indent=1,sort_keys=True)
+    f.close()
+    print "Wrote manifest: "+manifestPath
+    return manifestPath
+
+def main(args):
+    parser=argparse.ArgumentParser(prog="python -m shaderBuilder")
+    commands=parser.add_subparsers(dest="command")
+    p=commands.add_parser("precompile",help="generate every shader variant for a script")
+    p.add_argument("script",help="path to the generator script (.gen)")
+    p.add_argument("--lib",action="append",help="library folder (may be repeated). Defaults to library")
+    p.add_argument("--out",default="ShadersOut/precompiled",help="cache folder to write shaders to")
+    p.add_argument("--processes",type=int,default=None,help="number of worker processes. Defaults to the number of cpus")
+    p.add_argument("--tag",action="append",default=[],help="name=value: a tag value to enumerate (may be repeated)")
+    options=parser.parse_args(args)
+
+    try:
+        tagValues=parseTagValues(options.tag)
+    except ValueError as e:
+        parser.error(str(e))
+    precompileScript(options.script,options.lib or ["library"],options.out,options.processes,tagValues)
+    return 0
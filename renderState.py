@@ -1,4 +1,10 @@
+import collections
+import weakref
 from panda3d.core import ShaderAttrib
+import shaderCache
+
+# the kinds of features RenderStates can have, see RenderStateFactory.getFeatures
+featureKinds=("tag","shaderInput","hasRenderAttrib","column","flag")
 
 
 # Since the NodeType subclasses need some convention on what will be used for the renderState
@@ -8,14 +14,34 @@ from panda3d.core import ShaderAttrib
 # The set of what to store is collected by the RenderStateFactory
 
 class RenderStateFactory(object):
-    def __init__(self):
+    def __init__(self,maxMemoEntries=128):
         self.tags=set() # add tags we care about here, by name
         self.shaderInputs=set() # add shaderInput names we care about here, by name
         self.hasRenderAttribs=set()  # add RenderAttrib.getClassSlot() values here if the presense matters (not the specific value)
         #self.renderAttribs=set() # add RenderAttrib.getClassSlot() values here
         self.geomVertexDataColumns=set() # by name
         self.flags=set()
-    def getRenderState(self,pandaNode,pandaRenderState=None,geomVertexFormat=None,flags=()):
+        
+        # maps feature kind, then name, to the bit used for the feature in RenderState.mask
+        # bits are assigned as features are first seen
+        self.bits=dict((kind,{}) for kind in featureKinds)
+        self._bitCount=0
+        
+        # interned RenderStates, by (mask,tags)
+        self.renderStates=weakref.WeakValueDictionary()
+        
+        # maps (panda3d.RenderState,GeomVertexFormat,tags,flags) to RenderState
+        # Panda3D interns RenderStates and GeomVertexFormats, so scenes with many geoms
+        # tend to only have a few distinct keys. See getRenderState
+        # The keys keep their panda3d.RenderStates (and the textures and shader inputs in them) alive,
+        # and Panda3D's objects can't be weakly referenced, so this is kept small
+        self.memo=shaderCache.LRUCache(maxMemoEntries)
+    
+    def clearMemo(self):
+        """ call after changing which features are watched, if getRenderState has already been used """
+        self.memo.clear()
+    
+    def getRenderState(self,pandaNode,pandaRenderState=None,geomVertexFormat=None,flags=(),tagDict=None):
         """
         returns a RenderState instance for a given pandaNode, and optionally a specified panda3d.RenderState
         
@@ -24,10 +50,22 @@ class RenderStateFactory(object):
         but can be passed seperatly as in the cause when using geoms. In that case, pandaNode should
         be the panda3d.GeomNode
         
+        tagDict is the values of the watched tags on pandaNode (see getTagDict). If None, it is looked up.
+        
+        flags is the flags to set. Only the ones this factory watches (see self.flags) are used.
+        
         """
         if pandaRenderState is None: pandaRenderState=pandaNode.getNetState()
         
-        return self._getRenderState(self._getTagDict(pandaNode),pandaRenderState,geomVertexFormat,flags)
+        if tagDict is None: tagDict=self._getTagDict(pandaNode)
+        # flags nothing watches don't change the shader, so they must not change the RenderState (or its cache key)
+        flags=frozenset(self.flags.intersection(flags))
+        key=(pandaRenderState,geomVertexFormat,frozenset(tagDict.iteritems()),flags)
+        renderState=self.memo.get(key)
+        if renderState is None:
+            renderState=self._getRenderState(tagDict,pandaRenderState,geomVertexFormat,flags)
+            self.memo.put(key,renderState)
+        return renderState
     
     def _getTagDict(self,pandaNode):
         tags={}
@@ -35,24 +73,137 @@ class RenderStateFactory(object):
             if pandaNode.hasNetTag(t): tags[t]=pandaNode.getNetTag(t)
         return tags
     
+    def getTagDict(self,nodePath,parentTags=None):
+        """
+        returns a dict of the values of the watched tags on nodePath, including those inherited from its ancestors.
+        
+        If parentTags (the result of this for nodePath's parent) is passed, only nodePath's own tags are looked up,
+        which saves walking up to the root for each tag when traversing a scene graph.
+        The returned dict may be parentTags itself, so don't modify it.
+        """
+        if parentTags is None: return self._getTagDict(nodePath)
+        tags=parentTags
+        for t in self.tags:
+            if nodePath.hasTag(t):
+                value=nodePath.getTag(t)
+                if tags.get(t)!=value:
+                    if tags is parentTags: tags=dict(parentTags)
+                    tags[t]=value
+        return tags
+    
+    def _getBit(self,kind,name):
+        """ returns the bit (as a mask) for the feature, assigning a new one if needed """
+        bits=self.bits[kind]
+        bit=bits.get(name)
+        if bit is None:
+            bit=bits[name]=1<<self._bitCount
+            self._bitCount+=1
+        return bit
+    
+    def _getMask(self,kind,names):
+        mask=0
+        for name in names:
+            mask|=self._getBit(kind,name)
+        return mask
+    
+    def _intern(self,mask,tagDict):
+        tags=tuple(sorted(tagDict.iteritems()))
+        key=(mask,tags)
+        renderState=self.renderStates.get(key)
+        if renderState is None:
+            renderState=self.renderStates[key]=RenderState(self.bits,mask,tags)
+        return renderState
+    
     def _getRenderState(self,tagDict,pandaRenderState,geomVertexFormat,flags):
+        mask=self._getMask("tag",tagDict)|self._getMask("flag",flags)
+        
         shaderAtrib=pandaRenderState.getAttrib(ShaderAttrib.getClassSlot())
         if shaderAtrib:
             # basically we want the intersection of self.shaderInputs, and the shader inputs in shaderAtrib
             # but to do this, we need this rather contrived approach,
             # since there is no way to get the set of shader inputs in a shaderAtrib,
             # or ask if it contains one
-            shaderInputs=frozenset(s for s in self.shaderInputs if shaderAtrib.getShaderInput(s).getName() is not None)
-        else:
-            shaderInputs=frozenset()
+            mask|=self._getMask("shaderInput",(s for s in self.shaderInputs if shaderAtrib.getShaderInput(s).getName() is not None))
         
-        hasRenderAttribs=frozenset(slot for slot in self.hasRenderAttribs if pandaRenderState.hasAttrib(slot))
+        mask|=self._getMask("hasRenderAttrib",(slot for slot in self.hasRenderAttribs if pandaRenderState.hasAttrib(slot)))
         if geomVertexFormat is not None:
-            columns=frozenset(column for column in self.geomVertexDataColumns if geomVertexFormat.hasColumn(column))
-        else:
-            columns=frozenset()
+            mask|=self._getMask("column",(column for column in self.geomVertexDataColumns if geomVertexFormat.hasColumn(column)))
 
-        return RenderState(pandaRenderState,tagDict,shaderInputs,hasRenderAttribs,columns,frozenset(flags))
+        return self._intern(mask,tagDict)
+    
+    def makeRenderState(self,tagDict,shaderInputs,hasRenderAttribs,columns,flags,pandaRenderState=None):
+        """
+        returns a RenderState made directly from the passed features, without looking at the scene graph.
+        Features this factory does not watch are still included, so filter them first if needed.
+        """
+        mask=(self._getMask("tag",tagDict)|
+            self._getMask("shaderInput",shaderInputs)|
+            self._getMask("hasRenderAttrib",hasRenderAttribs)|
+            self._getMask("column",columns)|
+            self._getMask("flag",flags))
+        return self._intern(mask,tagDict)
+    
+    def getFeatures(self):
+        """
+        returns a list of (kind,name) for every feature this factory watches, in a stable order.
+        kind is one of featureKinds
+        """
+        kinds=(
+            ("tag",self.tags),
+            ("shaderInput",self.shaderInputs),
+            ("hasRenderAttrib",self.hasRenderAttribs),
+            ("column",self.geomVertexDataColumns),
+            ("flag",self.flags),
+            )
+        return [(kind,name) for kind,names in kinds for name in sorted(names)]
+    
+    def allRenderStates(self,tagValue="",tagValues={}):
+        """
+        returns a sequence of RenderStates covering every combination of the watched features being present or not.
+        They are made on demand when indexed.
+        
+        RenderStates include the values of their tags (and getCacheKey does too), so a tag is enumerated
+        as absent, or present with each of the values in tagValues[name] (a list).
+        Tags not in tagValues only get tagValue. Pass the values the scene actually uses,
+        or states precompiled with this won't match the geoms at runtime.
+        
+        There are 2**(number of non tag features) * the product of (1+number of values) for each tag of them.
+        """
+        return RenderStateCombinations(self,tagValue,tagValues)
+
+
+class RenderStateCombinations(object):
+    """
+    
+    A lazy sequence of every combination of a RenderStateFactory's features. See RenderStateFactory.allRenderStates
+    
+    Index i is a mixed radix number with a digit for each feature, in the order of RenderStateFactory.getFeatures
+    (least significant first). A digit of 0 means the feature is absent. For a tag, a digit d>0 means it is present
+    with its d-1th value. For other features, the digits are bits.
+    
+    """
+    def __init__(self,factory,tagValue="",tagValues={}):
+        self.factory=factory
+        self.features=factory.getFeatures()
+        # for each feature, None if it is not a tag, otherwise the list of values it is enumerated with
+        self.values=[list(tagValues.get(name,(tagValue,))) if kind=="tag" else None for kind,name in self.features]
+        self.count=1
+        for values in self.values:
+            self.count*=2 if values is None else 1+len(values)
+    def __len__(self):
+        return self.count
+    def __getitem__(self,index):
+        if not 0<=index<len(self): raise IndexError(index)
+        present=collections.defaultdict(list)
+        tagDict={}
+        for (kind,name),values in zip(self.features,self.values):
+            if values is None:
+                index,digit=divmod(index,2)
+                if digit: present[kind].append(name)
+            else:
+                index,digit=divmod(index,1+len(values))
+                if digit: tagDict[name]=values[digit-1]
+        return self.factory.makeRenderState(tagDict,present["shaderInput"],present["hasRenderAttrib"],present["column"],present["flag"])
     
 class RenderState(object):
     """
@@ -61,43 +212,54 @@ class RenderState(object):
     It stores stuff we want to ignore (which could be removed, but its simpler to just store what we want)
     It does not store everything we may want (allowing tags to trigger shader generator stuff is cool)
     
-    Flyweight is not used here because it can be confusing when the class gets subclassed,
-    and isn't needed anyway. Regardless, a fast comparison, and good hash are needed for the cache.
-    When subclassing to add more fields, be sure to __eq__ the comparison and __hash__ methods.
+    RenderStates are made and interned by a RenderStateFactory: the presence of each feature is a bit in mask
+    (assigned by the factory, see RenderStateFactory.bits), and the values of the present tags are in tags.
+    Since they are interned, they are compared and hashed by identity, which is fast, and makes good cache keys.
+    RenderStates from different factories are never equal.
+    
+    When subclassing to add more fields, be sure to subclass RenderStateFactory to intern them too.
     
     """
-    def __init__(self,pandaRenderState,tagDict,shaderInputSet,hasRenderAttribs,columns,flags):
-        self.shaderInputs=shaderInputSet
-        self.tags=tagDict
-        self.hasRenderAttribs=hasRenderAttribs
-        self.columns=columns
-        self.flags=flags
-        # TODO : better hash
-        self._hash = hash(shaderInputSet) ^ len(tagDict) ^ hash(hasRenderAttribs) ^ hash(columns) ^ hash(flags)
+    __slots__=("bits","mask","tags","__weakref__")
+    def __init__(self,bits,mask,tags):
+        # maps feature kind, then name to its bit. Shared with (and updated by) the factory
+        self.bits=bits
+        self.mask=mask
+        # tuple of (name,value) for the present tags, sorted by name
+        self.tags=tags
+    
+    def _has(self,kind,name):
+        return self.mask&self.bits[kind].get(name,0)!=0
     
     def hasGeomVertexDataColumns(self,name):
-        return name in self.columns
+        return self._has("column",name)
     
     def hasRenderAttrib(self,slot):
-        return slot in self.hasRenderAttribs
+        return self._has("hasRenderAttrib",slot)
     
     def hasShaderInput(self,name):
-        return name in self.shaderInputs
+        return self._has("shaderInput",name)
     
     def hasTag(self,name):
-        return name in self.tags
+        return self._has("tag",name)
     
     def getTag(self,name,default=None):
-        return self.tag.get(name,default)
+        for tagName,value in self.tags:
+            if tagName==name: return value
+        return default
     
     def hasFlag(self,name):
-        return name in self.flags
+        return self._has("flag",name)
     
-    def __hash__(self):
-        return self._hash
+    def getFeatures(self,kind):
+        """ returns a sorted list of the names of the present features of the passed kind (see RenderStateFactory.getFeatures) """
+        return sorted(name for name,bit in self.bits[kind].iteritems() if self.mask&bit)
     
-    def __eq__(self,other):
-        return self.shaderInputs==other.shaderInputs and self.tags==other.tags and self.hasRenderAttribs==other.hasRenderAttribs and self.columns==other.columns and self.flags==other.flags
+    def getCacheKey(self):
+        """
+        returns a string identifying this RenderState that is stable across runs (unlike hash)
+        used by shaderCache.DiskCache
+        """
+        return repr((self.getFeatures("shaderInput"),list(self.tags),self.getFeatures("hasRenderAttrib"),self.getFeatures("column"),self.getFeatures("flag")))
     
-    def __repr__(self): return "RenderState"+str((self.shaderInputs,self.tags,self.shaderInputs,self.hasRenderAttribs,self.columns,self.flags))
-        
+    def __repr__(self): return "RenderState"+self.getCacheKey()
@@ -1,12 +1,21 @@
 import itertools
 import collections
 import os
+import re
+import hashlib
 import renderState
+import shaderCache
+import decisionTree
+import stats
+import libCode
+import parallel
 
 import param
 import nodes
 
 import inspect
+import cPickle
+import threading
 
 from panda3d.core import Shader
 from direct.showbase.AppRunnerGlobal import appRunner
@@ -42,10 +51,9 @@ TODO :
 Loaders really need to assoiate file name and line numbers with all the loaded items
 so error reporting can be far more useful!
 
-TODO :
-
-Deployment system could concatenate libraries down to 1 file if desired,
-or one could pregenerate shaders and store them with their models in a cache
+Deployment:
+A loaded ShaderBuilder can be saved to a single file (ShaderBuilder.save), and loaded with loadBuilder
+without the script or libraries. Shaders can also be pregenerated into a cache (see precompile.py)
 if they don't need dynamic generation
 
 TODO :
@@ -68,26 +76,36 @@ def join(*paths):
 debugText=True
         
 
-def _parseFile(path):
+def _parseFile(path,offset=0,length=-1,firstLine=1):
+    """ parses the file at path, or just length bytes of it from offset (starting at line firstLine) """
+    f = open(path, 'rb')
+    f.seek(offset)
+    text=f.read(length)
+    f.close()
+    return _parseText(text,path,firstLine)
+
+def _cleanLine(t):
+    # Remove comments
+    i=t.find('#')
+    if i!=-1: t=t[:i]
+    
+    # Strip excess whitespace
+    return t.strip()
+
+def _parseText(text,path,firstLine=1):
     majorSections=collections.defaultdict(list)
-    f = open(path, 'r')
                 
     majorSection=None
     section=None
     
-    lineNum=0
+    lineNum=firstLine-1
     
     def warnText(): return "Warning: "+path+" line "+str(lineNum)+": "
     
-    for t in f.readlines():
+    for t in text.splitlines():
         lineNum+=1
-    
-        # Remove comments
-        i=t.find('#')
-        if i!=-1: t=t[:i]
         
-        # Strip excess whitespace
-        t=t.strip()
+        t=_cleanLine(t)
         
         
         if len(t)>0:
@@ -113,7 +131,6 @@ def _parseFile(path):
                     print warnText()+"throwing away invalid line occuring before first section in: "+path+" section: "+str(section)
                 elif currentList!=None:
                     currentList.append(t)
-    f.close()
     return majorSections
 
 def _parseInfoLines(lines,currentFile):
@@ -137,6 +154,7 @@ class NodeWrapper(object):
     
     sourceTracker is an optional debug dict for link to source scriptNode tracking
     """
+    __slots__=("_scriptNode","sourceTracker")
     def __init__(self,scriptNode,sourceTracker=None):
         self._scriptNode=scriptNode
         self.sourceTracker=sourceTracker
@@ -154,6 +172,192 @@ def _preprocessParam(param,sourceTracker=None):
     else:
         return param
 
+class _Block(object):
+    """
+    
+    A major section (":: node" or ":: lib") of a library file, found by _scanBlocks without parsing it.
+    
+    hash is a hash of its (cleaned) lines, so changes to comments and whitespace don't change it.
+    For node sections, name is the name from its info section (or None if missing),
+    and nodeType is its NodeType class, once made by getNodeType.
+    
+    """
+    def __init__(self,path,kind,offset,lineNum):
+        self.path=path
+        self.kind=kind
+        self.offset=offset
+        self.length=0
+        self.lineNum=lineNum
+        self.name=None
+        self.hasInfo=False
+        self.hash=None
+        self.nodeType=None
+    
+    def getNodeType(self):
+        """ returns the NodeType class for this node section, parsing it the first time """
+        if self.nodeType is None:
+            f=open(self.path,'rb')
+            f.seek(self.offset)
+            text=f.read(self.length)
+            f.close()
+            if _scanBlocks(text,self.path)[0].hash!=self.hash:
+                raise IOError("Library file "+self.path+" has changed since it was loaded, see Library.reload")
+            items=_parseText(text,self.path,self.lineNum)["node"][0]
+            self.nodeType=_makeNodeType(items,self.path)
+        return self.nodeType
+
+def _scanBlocks(text,path):
+    """
+    
+    splits the text of a library file into its major sections, returning a list of _Blocks.
+    
+    Only the section headers and node names are looked at, so this is much faster than parsing.
+    
+    """
+    blocks=[]
+    block=None
+    h=None
+    section=None
+    offset=0
+    lineNum=0
+    for line in text.splitlines(True):
+        lineNum+=1
+        t=_cleanLine(line)
+        if t[:2]=='::':
+            if block is not None:
+                block.length=offset-block.offset
+                block.hash=h.hexdigest()
+            block=_Block(path,t[2:].lower().strip(),offset,lineNum)
+            blocks.append(block)
+            h=hashlib.sha1()
+            section=None
+        if block is not None and t:
+            h.update(t+"\n")
+            if t[0]==':' and t[:2]!='::':
+                section=t[1:].lower().strip()
+                if section=="info": block.hasInfo=True
+            elif section=="info" and block.name is None:
+                info=t.split(None,1)
+                if len(info)==2 and info[0]=="name": block.name=info[1]
+        offset+=len(line)
+    if block is not None:
+        block.length=offset-block.offset
+        block.hash=h.hexdigest()
+    return blocks
+
+class LibraryFile(object):
+    """
+    
+    The contents of a library file: an index of the node types it defines, and its lib code.
+    
+    Node sections are only indexed (by name, see _Block) when the file is loaded.
+    Their NodeType classes are made when first used, so the cost of loading a library
+    scales with the node types actually used, not the size of the library.
+    
+    Instances are cached by path (see loadLibraryFile), so files are only scanned again when they change.
+    When they are, node types with unchanged sections reuse the NodeType classes from previous,
+    the LibraryFile for the old version of the file (if any).
+    
+    """
+    def __init__(self,path,mtime,size,previous=None):
+        self.path=path
+        self.mtime=mtime
+        self.size=size
+        
+        f=open(path, 'rb')
+        text=f.read()
+        f.close()
+        self.hash=shaderCache.hashString(text)
+        
+        # list of (name,_Block) in file order
+        self.nodes=[]
+        # list of libCode.LibBlocks, one for each lib section
+        self.libBlocks=[]
+        
+        oldBlocks=dict(previous.nodes) if previous is not None else {}
+        
+        for block in _scanBlocks(text,path):
+            if block.kind=="node":
+                if block.name is None:
+                    if block.hasInfo:
+                        print "invalid info entry missing name in: "+path
+                    else:
+                        print "node missing info section in: "+path
+                    continue
+                old=oldBlocks.get(block.name)
+                if old is not None and old.hash==block.hash:
+                    block.nodeType=old.nodeType
+                self.nodes.append((block.name,block))
+            elif block.kind=="lib":
+                for lib in _parseText(text[block.offset:block.offset+block.length],path,block.lineNum)["lib"]:
+                    if "code" in lib: self.libBlocks.append(libCode.LibBlock("\n".join(lib["code"])))
+            else:
+                print "Warning: throwing away invalid majorSection with unrecognized name: "+block.kind+" in file: "+path
+
+def _makeNodeType(items,currentFile):
+    """
+    returns the NodeType class for a parsed node section
+    """
+    info=_parseInfoLines(items["info"],currentFile)
+    name=info["name"]
+    
+    shaderInputs=[]
+    if "shaderinputs" in items:
+        for s in items["shaderinputs"]:
+            shaderInputs.append(param.shaderParamFromDefCode(s))
+    
+    if "output" in info:
+        o=info["output"]
+        assert o in ["True","False"]
+        isOutPut=o=="True"
+        assert "stage" in info
+        stage=info["stage"]
+    else:
+        isOutPut=False
+        stage=None
+    
+    inLinks=[]
+    if "inlinks" in items:
+        for s in items["inlinks"]:
+            inLinks.append(param.linkEndFromDefCode(s))
+    outLinks=[]
+    if "outlinks" in items:
+        for s in items["outlinks"]:
+            outLinks.append(param.linkEndFromDefCode(s))
+    
+    code=""
+    if "code" in items:
+        code="\n".join(items["code"])
+    
+    return nodes.metaCodeNode(name,code,shaderInputs,inLinks,outLinks,isOutPut=isOutPut,stage=stage)
+
+# maps path to LibraryFile, shared by all Libraries
+libraryFileCache={}
+
+def loadLibraryFile(path):
+    """ returns a LibraryFile for path, only parsing it if it has not been, or its modification time or size has changed """
+    st=os.stat(path)
+    libFile=libraryFileCache.get(path)
+    if libFile is None or libFile.mtime!=st.st_mtime or libFile.size!=st.st_size:
+        libFile=libraryFileCache[path]=LibraryFile(path,st.st_mtime,st.st_size,libFile)
+    return libFile
+
+class _NodeTypeClassMap(collections.Mapping):
+    """
+    a read only dict like view of a Library's node types, mapping name to NodeType class.
+    Node types from library files are only made when they are looked up, see Library.getNodeType
+    """
+    def __init__(self,library):
+        self.library=library
+    def __getitem__(self,name):
+        return self.library.getNodeType(name)
+    def __contains__(self,name):
+        return name in self.library.nodeTypeBlocks or name in self.library.baseNodeTypeClassMap
+    def __iter__(self):
+        return iter(self.library.getNodeTypeNames())
+    def __len__(self):
+        return len(self.library.getNodeTypeNames())
+
 class Library(object):
     def __init__(self,paths,nodeTypeClassMap={}):
         """
@@ -170,9 +374,10 @@ class Library(object):
         
         """
         
-        
-        self.nodeTypeClassMap=dict(nodes.defaultNodeClasses)
-        self.nodeTypeClassMap.update(nodeTypeClassMap)
+        self.baseNodeTypeClassMap=dict(nodes.defaultNodeClasses)
+        self.baseNodeTypeClassMap.update(nodeTypeClassMap)
+        # maps name to NodeType class for all the available node types (including those passed in). See getNodeType
+        self.nodeTypeClassMap=_NodeTypeClassMap(self)
         self.loadPath(paths)
     
     def loadPath(self,paths):
@@ -180,84 +385,117 @@ class Library(object):
         
         called by init, but can be called again if you wish to reload the same paths, or a different one
         
+        Files that have already been loaded (by any Library) and have not changed since are not parsed again,
+        see loadLibraryFile
+        
         """
         
+        self.paths=paths
         
-        libs=[]
+        # list of LibraryFiles in load order
+        self.files=[]
         
         for root, dirs, files in itertools.chain.from_iterable(os.walk(path) for path in paths):
-            for name in files:
+            # walk in sorted order so the load order (and thus libSource) does not depend on the file system
+            dirs.sort()
+            for name in sorted(files):
                 ext=os.path.splitext(name)[1]
                 if ext==".txt":
-                    currentFile=join(root, name)
-                    for key,xitems in _parseFile(currentFile).iteritems():
-                        if key=="node":
-                            for items in xitems:
-                                if "info" not in items:
-                                    print "node missing info section in: "+currentFile
-                                else:
-                                    
-                                    
-                                    info=_parseInfoLines(items["info"],currentFile)
-                                    
-                                    if "name" not in info:
-                                        print "invalid info entry missing name in: "+currentFile
-                                    else:
-                                        name=info["name"]
-                                        
-                                        shaderInputs=[]
-                                        if "shaderinputs" in items:
-                                            for s in items["shaderinputs"]:
-                                                shaderInputs.append(param.shaderParamFromDefCode(s))
-                                        
-                                        if "output" in info:
-                                            o=info["output"]
-                                            assert o in ["True","False"]
-                                            isOutPut=o=="True"
-                                            assert "stage" in info
-                                            stage=info["stage"]
-                                        else:
-                                            isOutPut=False
-                                            stage=None
-                                        
-                                        inLinks=[]
-                                        if "inlinks" in items:
-                                            for s in items["inlinks"]:
-                                                inLinks.append(param.linkEndFromDefCode(s))
-                                        outLinks=[]
-                                        if "outlinks" in items:
-                                            for s in items["outlinks"]:
-                                                outLinks.append(param.linkEndFromDefCode(s))
-                                        
-                                        
-                                        code=""
-                                        if "code" in items:
-                                            code="\n".join(items["code"])
-                                        
-                                        node=nodes.metaCodeNode(name,code,shaderInputs,inLinks,outLinks,isOutPut=isOutPut,stage=stage)
-                                        if name in self.nodeTypeClassMap:
-                                            print "Warning: overwriting node "+repr(self.nodeTypeClassMap[name])+" with "+repr(node)+" from "+currentFile
-                                        self.nodeTypeClassMap[name]=node
-                                
-                        elif key=="lib":
-                            libs.append(xitems)
-                        else:
-                            print "Warning: throwing away invalid majorSection with unrecognized name: "+key+" in file: "+currentFile
-                            
-        libSource="\n".join(itertools.chain.from_iterable(lib["code"] for lib in itertools.chain.from_iterable(libs) if "code" in lib))
+                    self.files.append(loadLibraryFile(join(root, name)))
         
-        self.libSource=libSource
+        # maps name to the _Block for the node types from the library files. These override baseNodeTypeClassMap
+        self.nodeTypeBlocks={}
+        for libFile in self.files:
+            for name,block in libFile.nodes:
+                if name in self.nodeTypeBlocks:
+                    print "Warning: overwriting node "+name+" from "+self.nodeTypeBlocks[name].path+" with the one from "+libFile.path
+                elif name in self.baseNodeTypeClassMap:
+                    print "Warning: overwriting node "+repr(self.baseNodeTypeClassMap[name])+" with "+name+" from "+libFile.path
+                self.nodeTypeBlocks[name]=block
+        
+        self.libCode=libCode.LibCode(itertools.chain.from_iterable(libFile.libBlocks for libFile in self.files))
+        self.libSource=self.libCode.getSource()
+        
+        # a hash of everything loaded, changes if any library file does (see shaderCache.DiskCache)
+        self.sourceHash=shaderCache.fingerprint(
+            repr(sorted((libFile.path,libFile.hash) for libFile in self.files)),
+            repr(sorted((name,repr(c)) for name,c in self.baseNodeTypeClassMap.iteritems())),
+            )
     
-
+    def getNodeTypeNames(self):
+        """ returns the set of names of all the available node types """
+        return set(self.baseNodeTypeClassMap)|set(self.nodeTypeBlocks)
+    
+    def getNodeType(self,name):
+        """ returns the NodeType class for name, making it from its library file if needed. Raises KeyError if missing """
+        block=self.nodeTypeBlocks.get(name)
+        if block is not None: return block.getNodeType()
+        return self.baseNodeTypeClassMap[name]
+    
+    def _getNodeTypeVersions(self):
+        """ returns a dict mapping node type names to values that are equal only if the node types are the same """
+        versions=dict(self.baseNodeTypeClassMap)
+        for name,block in self.nodeTypeBlocks.iteritems():
+            versions[name]=(block.path,block.hash)
+        return versions
     
-    def loadScript(self,path,viewGraph=False):
+    def reload(self):
+        """
+        
+        loads the library's paths again, only parsing the files that changed.
+        
+        returns the set of names of node types that were added, removed or changed.
+        Node types whose definitions did not change keep the same classes.
+        
+        """
+        old=self._getNodeTypeVersions()
+        self.loadPath(self.paths)
+        new=self._getNodeTypeVersions()
+        return set(name for name in set(old)|set(new) if old.get(name)!=new.get(name))
+    
+    def loadScript(self,path,viewGraph=False,cachePath=None):
         """
         loads a generater script at path, returns a ShaderBuilder
+        
+        if cachePath is provided, generated shader source is cached on disc there
+        (see shaderCache.DiskCache), and reused across runs
         """
-        return ShaderBuilder(self._parseScript(path,viewGraph),self.libSource)
+        fingerprint=self._fingerprint(path)
+        builder=ShaderBuilder(self._parseScript(path,viewGraph),self.libCode,_makeDiskCache(cachePath,fingerprint))
+        builder.scriptPath=path
+        builder.cachePath=cachePath
+        builder.fingerprint=fingerprint
+        return builder
+    
+    def reloadScript(self,builder,changedNodeTypes=None):
+        """
+        
+        updates builder (which must have been made by loadScript) to use the current version of its script and this library,
+        for use after the script or library files change (see reload, and hotReload.Watcher)
+        
+        If changedNodeTypes (a set of node type names, as returned by reload) is provided, the script and libSource must
+        not have changed, and only the cached shaders that used the named node types are discarded.
+        Otherwise all the builder's cached shaders are discarded.
+        
+        """
+        nodes=self._parseScript(builder.scriptPath)
+        builder.fingerprint=self._fingerprint(builder.scriptPath)
+        builder.setGraph(nodes,self.libCode,_makeDiskCache(builder.cachePath,builder.fingerprint),changedNodeTypes)
+    
+    def _fingerprint(self,path):
+        """ returns the fingerprint (see shaderCache.DiskCache) of the script at path, loaded with this library """
+        f=open(path,'rb')
+        scriptSource=f.read()
+        f.close()
+        return shaderCache.fingerprint(self.sourceHash,scriptSource)
     
     def _parseScript(self,path,viewGraph=False):
-        # setup some globals with the names of the Node classes in self.nodeTypeClassMap
+        f=open(path)
+        scriptSource=f.read()
+        f.close()
+        
+        # setup some globals with the names of the Node classes the script uses.
+        # Only the node types whose names appear in the script are made (see getNodeType)
         scriptGlobals={}
         if viewGraph:
             nodeInfoDict={}
@@ -265,7 +503,9 @@ class Library(object):
         else:
             sourceTracker=None
         
-        for name,nodeType in self.nodeTypeClassMap.iteritems():
+        names=self.getNodeTypeNames()&set(re.findall(r"[A-Za-z_]\w*",scriptSource))
+        for name in names:
+            nodeType=self.getNodeType(name)
             
             # this closure is the auctual item put into the scriptGlobals for the script
             # it poses as a Node class, but produces NodeWrappers instead of Nodes,
@@ -289,12 +529,17 @@ class Library(object):
         
         # run the script with the newly made scriptGlobals
         nodeList=[]
+        links=[]
         
-        if isP3d:
-            # don't use execfile since this works easier within p3d files
-            exec open(path).read() in scriptGlobals
-        else:
-            execfile(path,scriptGlobals,{})
+        nodes.recordLinks(links)
+        try:
+            if isP3d:
+                # don't use execfile since this works easier within p3d files
+                exec scriptSource in scriptGlobals
+            else:
+                execfile(path,scriptGlobals,{})
+        finally:
+            nodes.recordLinks(None)
         
         if viewGraph:
             import pydot
@@ -314,7 +559,7 @@ class Library(object):
                         graph.add_edge(e)
             writeGraph(graph,path)
             
-        return nodeList
+        return nodes.FrozenGraph(nodeList,links)
 
 
 # a little helper for naming stuff in viewGraph's graphs
@@ -326,6 +571,89 @@ def writeGraph(graph,path):
     finalPath=path+"."+format
     print 'Making Graph: '+finalPath
     graph.write(finalPath,format=format)
+
+def _makeDiskCache(cachePath,fingerprint):
+    if cachePath is None: return None
+    return shaderCache.DiskCache(cachePath,fingerprint)
+
+# bump this when changes are made that would make previously saved ShaderBuilders (see ShaderBuilder.save) invalid
+builderFileVersion=1
+
+def loadBuilder(path,cachePath=None):
+    """
+    
+    loads a ShaderBuilder saved with ShaderBuilder.save, without running its script or loading any libraries.
+    
+    if cachePath is provided, generated shader source is cached on disc there (see shaderCache.DiskCache).
+    The cache is shared with the builder that was saved, so shaders precompiled for it (see precompile.py) are used.
+    
+    """
+    f=open(path,'rb')
+    data=cPickle.load(f)
+    f.close()
+    if data["version"]!=builderFileVersion:
+        raise ValueError("Saved ShaderBuilder "+path+" has version "+str(data["version"])+", expected "+str(builderFileVersion))
+    builder=ShaderBuilder(data["nodes"],data["libSource"],_makeDiskCache(cachePath,data["fingerprint"]))
+    builder.cachePath=cachePath
+    builder.fingerprint=data["fingerprint"]
+    return builder
+
+def precompileStates(builder,renderStates,processes=None,chunkSize=1024):
+    """
+    
+    generates the shaders for all of renderStates, writing each distinct one into builder.diskCache
+    
+    renderStates may be a lazy sequence (like RenderStateFactory.allRenderStates). They are handled chunkSize at a time,
+    and each chunk is written to the disk cache before the next is started. Nothing is kept for each RenderState,
+    so memory use grows with the number of distinct paths through the graph and distinct shaders, not of RenderStates.
+    
+    Each RenderState is resolved to its active nodes with a decision tree (see decisionTree.py), so the generator graph
+    is only evaluated once for each distinct path through it, and source is only generated (on a pool of processes,
+    see parallel.forkMap) for active graphs that have not been seen before. Other RenderStates just get an entry
+    pointing at the source already written.
+    
+    returns a dict mapping each distinct source hash written (see shaderCache.DiskCache) to the number of RenderStates using it,
+    and the number of RenderStates the generator graph rejected (by failing an assertion, see AssertActiveNode and Output)
+    
+    """
+    assert builder.diskCache is not None, "precompiling requires a ShaderBuilder with a diskCache"
+    
+    # the tree only keeps the tuples of active nodes (not ActiveGraphs, which are much larger),
+    # and the same tuple for all the paths that produce the same active nodes
+    activeNodeTuples={}
+    def evaluate(renderState):
+        # rejections are kept in the tree too, since there can be many RenderStates on the same rejected path
+        try:
+            activeNodes=tuple(builder.nodes.evaluate(renderState))
+        except AssertionError as e:
+            return e
+        return activeNodeTuples.setdefault(activeNodes,activeNodes)
+    tree=decisionTree.DecisionTree(evaluate)
+    
+    # maps the tuples of active nodes written so far to their source hashes
+    written={}
+    counts={}
+    rejected=0
+    for start in xrange(0,len(renderStates),chunkSize):
+        chunk=[renderStates[i] for i in xrange(start,min(start+chunkSize,len(renderStates)))]
+        with generationLock:
+            results=[tree.get(renderState) for renderState in chunk]
+            new=[]
+            for activeNodes in results:
+                if not isinstance(activeNodes,AssertionError) and activeNodes not in written:
+                    written[activeNodes]=None
+                    new.append(activeNodes)
+            generated=parallel.forkMap(builder._generateSourceFromGraph,[ActiveGraph(activeNodes) for activeNodes in new],processes)
+        for activeNodes,(stages,source) in zip(new,generated):
+            written[activeNodes]=builder.diskCache.putSource(source)
+        for renderState,activeNodes in zip(chunk,results):
+            if isinstance(activeNodes,AssertionError):
+                rejected+=1
+            else:
+                sourceHash=written[activeNodes]
+                builder.diskCache.putSourceHash(renderState,sourceHash)
+                counts[sourceHash]=counts.get(sourceHash,0)+1
+    return counts,rejected
         
 class ShaderBuilder(object):
     """
@@ -333,24 +661,177 @@ class ShaderBuilder(object):
     A factory for shaders based off a set of Nodes. Make one instance for each distinct set of stages.
     
     """
-    def __init__(self,nodes,libSource=""):
+    def __init__(self,nodes_,libSource="",diskCache=None,maxCacheEntries=None,maxCacheBytes=None):
         """
         
-        Takes an dict of lists of Nodes, and sets this instance up to produce shaders based on them.
+        Takes a nodes.FrozenGraph (or a list of Nodes in topological order, which is frozen, see nodes.freeze),
+        and sets this instance up to produce shaders based on them.
+        
+        libSource is either a string of code to include in every shader, or a libCode.LibCode,
+        in which case each shader only includes the lib code its stages use
+        
+        diskCache is an optional shaderCache.DiskCache used to persist generated source between runs
+        
+        maxCacheEntries and maxCacheBytes limit the size of the in memory caches, see setCacheLimits
         
         """
-        self.nodes=nodes
+        self.nodes=nodes.freeze(nodes_)
+        self.diskCache=diskCache
+        
+        # set by Library.loadScript, needed for Library.reloadScript
+        self.scriptPath=None
+        self.cachePath=None
+        # identifies the script and libraries this was loaded from (see Library._fingerprint). Set by Library.loadScript
+        self.fingerprint=None
+        
+        # caches the ActiveGraphs for RenderStates, by the RenderState features the nodes use
+        self.decisionTree=decisionTree.DecisionTree(self._makeActiveGraph)
         
         # a cache of finished shaders. Maps RenderState to Shader
-        self.cache={}
+        self.cache=shaderCache.LRUCache()
         
-        # a cache of finished shaders. Maps set of stage source strings to Shader
-        self.casheByStages={}
+        # a cache of finished shaders. Maps set of stage source strings to (Shader,length of its source,hash of its source)
+        # The length is the size charged to the caches for the shader, see setCacheLimits.
+        # The hash lets RenderStates that share the shader be written to the disk cache without regenerating the source
+        self.casheByStages=shaderCache.LRUCache()
+        
+        self.setCacheLimits(maxCacheEntries,maxCacheBytes)
         
-        self.header="//Cg\n//AUTO-GENERATED-SHADER//\n\n"+libSource+"\n\n"
         self.footer="\n\n//END-AUTO-GENERATED-SHADER//\n"
+        self._setLibSource(libSource)
+        
+        
+    
+    def _makeActiveGraph(self,renderState):
+        t=stats.shared.start()
+        activeGraph=makeActiveGraph(self.nodes,renderState)
+        stats.shared.stop("makeActiveGraph",t)
+        return activeGraph
+    
+    def _makeShader(self,source):
+        t=stats.shared.start()
+        shader=Shader.make(source, Shader.SLCg)
+        stats.shared.stop("Shader.make",t)
+        return shader
+    
+    def setGraph(self,nodes_,libSource,diskCache=None,changedNodeTypes=None):
+        """
+        
+        replaces the nodes and libSource (see __init__) this builder uses.
+        
+        If changedNodeTypes is None, all cached shaders are discarded. Otherwise it should be the set of names
+        of the (library) node types that differ between the old and new nodes, and only the cached shaders
+        whose active graphs used one of them are discarded. See Library.reloadScript
+        
+        The stageCache entries made from the old nodes are always discarded, since they can't be reused, see discardGraph
+        
+        """
+        with generationLock:
+            self._setGraph(nodes_,libSource,diskCache,changedNodeTypes)
+    
+    def _setGraph(self,nodes_,libSource,diskCache,changedNodeTypes):
+        if changedNodeTypes is None:
+            self.cache.clear()
+            self.casheByStages.clear()
+        else:
+            # find the affected shaders using the old nodes
+            discarded=set()
+            for renderState in self.cache.keys():
+                if self.decisionTree.get(renderState).nodeTypes & changedNodeTypes:
+                    discarded.add(self.cache.pop(renderState))
+            for stages,(shader,size,sourceHash) in self.casheByStages.items():
+                if shader in discarded:
+                    self.casheByStages.pop(stages)
+        discardGraph(self.nodes)
         
+        self.nodes=nodes.freeze(nodes_)
+        self.diskCache=diskCache
+        self.decisionTree.clear()
+        self._setLibSource(libSource)
+    
+    def _setLibSource(self,libSource):
+        # as passed to __init__ or setGraph, kept for save
+        self.libSource=libSource
+        if isinstance(libSource,libCode.LibCode):
+            self.libCode=libSource
+            libSource=""
+        else:
+            self.libCode=None
+        self.header="//Cg\n//AUTO-GENERATED-SHADER//\n\n"+libSource+"\n\n"
+    
+    def setCacheLimits(self,maxEntries=None,maxBytes=None):
+        """
+        limits the number of entries in, and the total source size of the shaders in each of this builder's caches.
+        Least recently used shaders are evicted first. None means unlimited.
+        See also setStageCacheLimits for the cache shared by all builders.
+        """
+        self.cache.setLimits(maxEntries,maxBytes)
+        self.casheByStages.setLimits(maxEntries,maxBytes)
+    
+    def getCacheStats(self):
+        """
+        returns a dict of statistics (see shaderCache.LRUCache.getStats) for this builder's caches,
+        as well as the shared stage cache, and the ActiveNode flyweight caches.
+        """
+        return {
+            "cache":self.cache.getStats(),
+            "casheByStages":self.casheByStages.getStats(),
+            "stageCache":stageCache.getStats(),
+            "activeNodes":len(nodes.ActiveNode.cache),
+            "activeOutputs":len(nodes.ActiveOutput.cache),
+            }
+    
+    def enableStats(self,enabled=True):
+        """ turns the timers (see stats.py) on or off. Note that they are shared by all ShaderBuilders """
+        stats.shared.enabled=enabled
+    
+    def getStats(self):
+        """
+        
+        returns a snapshot of the statistics for this builder:
+            "caches": see getCacheStats
+            "diskCache": see shaderCache.DiskCache.getStats (if this builder has a disk cache)
+            "decisionTree": the number of times the generator graph has been evaluated
+            "times" and "counts": total time spent in, and the number of calls to, the timed phases (see stats.py):
+                makeStages, makeActiveGraph, makeStage, StageBuilder (building source for a stage) and Shader.make
+                Times include time spent in nested phases, and are only recorded while enabled (see enableStats)
+        
+        """
+        result=stats.shared.getStats()
+        result["caches"]=self.getCacheStats()
+        result["decisionTree"]={"evaluations":self.decisionTree.evaluations}
+        if self.diskCache is not None:
+            result["diskCache"]=self.diskCache.getStats()
+        return result
+    
+    def resetStats(self):
+        """ resets the statistics returned by getStats (except the number of entries in the caches) """
+        stats.shared.reset()
+        self.cache.resetStats()
+        self.casheByStages.resetStats()
+        stageCache.resetStats()
+        self.decisionTree.evaluations=0
+        if self.diskCache is not None:
+            self.diskCache.resetStats()
+    
+    def save(self,path):
+        """
         
+        saves this builder's generator graph and lib code to path, so it can be loaded with loadBuilder
+        without running the script or parsing the libraries (for example, in a shipped build).
+        
+        Custom python node types must be importable when loading. None of the caches are saved.
+        
+        """
+        data={
+            "version":builderFileVersion,
+            "nodes":self.nodes,
+            "libSource":self.libSource,
+            "fingerprint":self.fingerprint,
+            }
+        f=open(path,'wb')
+        cPickle.dump(data,f,cPickle.HIGHEST_PROTOCOL)
+        f.close()
     
     def setupRenderStateFactory(self,factory=None):
         """
@@ -363,7 +844,7 @@ class ShaderBuilder(object):
         return factory
         
         
-    def getShader(self,renderState,debugFile=None,noChache=False,debugGraphPath=None):
+    def getShader(self,renderState,debugFile=None,noChache=False,debugGraphPath=None,wait=True):
         """
         
         returns a shader appropriate for the passed RenderState
@@ -373,6 +854,9 @@ class ShaderBuilder(object):
         noChache forces the generation of the shader (but it will still get cached).
         Useful for use with debugFile if you need to see the source, but it may be cached
         
+        If wait is False and the shader needs generating while another thread holds generationLock
+        (ex: a background.BackgroundBuilder's worker), None is returned instead of waiting for it.
+        
         caching system isn't verg good in the case where the render state is different, but the resulting shader is the same.
         It will find the shader in the cache, but it will take a while.
         
@@ -380,34 +864,38 @@ class ShaderBuilder(object):
         
         
         
-        shader=self.cache.get(renderState)
-        if shader and not noChache:
-            #if debugFile: print "Shader is cached (renderState cache). Skipping generating shader to: "+debugFile
-            return shader
-        
+        if not noChache:
+            shader=self.getCachedShader(renderState)
+            if shader:
+                #if debugFile: print "Shader is cached (renderState cache). Skipping generating shader to: "+debugFile
+                return shader
         
         if debugGraphPath:
             debugGraphPath+=str(len(self.casheByStages))
-            
-        stages=makeStages(self.nodes,renderState,debugGraphPath)
         
-        stages=frozenset(stages)
-        shader=self.casheByStages.get(stages)
-        if shader and not noChache:
-            self.cache[renderState]=shader
+        if not generationLock.acquire(wait): return None
+        try:
+            t=stats.shared.start()
+            stages=self.decisionTree.get(renderState).makeStages(debugGraphPath)
+            
+            stages=frozenset(stages)
+            stats.shared.stop("makeStages",t)
+        finally:
+            generationLock.release()
+        cached=self.casheByStages.get(stages)
+        if cached and not noChache:
+            shader,size,sourceHash=cached
+            self.cache.put(renderState,shader,size)
+            if self.diskCache is not None:
+                if self.diskCache.hasSource(sourceHash):
+                    self.diskCache.putSourceHash(renderState,sourceHash)
+                else:
+                    self.diskCache.put(renderState,self.getSource(stages))
             #if debugFile: print "Shader is cached (renderState cache). Skipping generating shader to: "+debugFile
             return shader
 
         
-        # TODO : Auto generate/match unspecified semantics here
-        
-        stageCode="\n\n".join(stages)
-        
-        
-        source = self.header+"\n\n"+stageCode+self.footer
-        
-        
-        
+        source=self.getSource(stages)
         
         if debugFile:
             debugFile+=str(len(self.casheByStages))+".sha"
@@ -419,62 +907,242 @@ class ShaderBuilder(object):
             fOut.write(source)
             fOut.close()
         
-        shader=Shader.make(source, Shader.SLCg)
-        self.cache[renderState]=shader
-        self.casheByStages[stages]=shader
+        # casheByStages was already checked above, so don't count another lookup in its stats
+        return self._cacheShader(renderState,stages,source,cached)
+    
+    def getCachedShader(self,renderState):
+        """ returns the shader for renderState if it is in the memory or disk cache, otherwise None (without generating it) """
+        shader=self.cache.get(renderState)
+        if shader: return shader
+        
+        if self.diskCache is not None:
+            source=self.diskCache.get(renderState)
+            if source is not None:
+                shader=self._makeShader(source)
+                self.cache.put(renderState,shader,len(source))
+                return shader
+        return None
+    
+    def _addShader(self,renderState,stages,source):
+        """ makes (or reuses, if the stages match) the shader for generated source, and caches it """
+        return self._cacheShader(renderState,stages,source,self.casheByStages.get(stages))
+    
+    def _cacheShader(self,renderState,stages,source,cached):
+        """ _addShader, where cached is the result of looking up stages in casheByStages (None if it was not there) """
+        if self.diskCache is not None:
+            self.diskCache.put(renderState,source)
+        
+        if cached is None:
+            cached=self._makeShader(source),len(source),shaderCache.hashString(source)
+            self.casheByStages.put(stages,cached,cached[1])
+        shader,size,sourceHash=cached
+        self.cache.put(renderState,shader,size)
         return shader
+    
+    def getShaders(self,renderStates,processes=None):
+        """
+        
+        returns a list of shaders for renderStates, like calling getShader for each of them
+        
+        The source for all the RenderStates that are not cached is generated first, see generateSources.
+        Only making the shaders from the source is done on this thread.
+        processes defaults to the number of cpus.
+        
+        """
+        missing=[]
+        for renderState in set(renderStates):
+            if renderState in self.cache: continue
+            if self.diskCache is not None:
+                source=self.diskCache.get(renderState)
+                if source is not None:
+                    self.cache.put(renderState,self._makeShader(source),len(source))
+                    continue
+            missing.append(renderState)
+        
+        for renderState,generated in zip(missing,self.generateSources(missing,processes)):
+            # RenderStates the generator graph rejects are left for getShader to raise the error
+            if not isinstance(generated,AssertionError):
+                stages,source=generated
+                self._addShader(renderState,stages,source)
+        
+        return [self.getShader(renderState) for renderState in renderStates]
+    
+    def getSource(self,stages):
+        """
+        returns the complete shader source for the passed set of stage source strings (see makeStages)
+        """
+        # TODO : Auto generate/match unspecified semantics here
+        
+        # stages is a set, so sort it to make the source canonical
+        stageCode="\n\n".join(sorted(stages))
+        header=self.header
+        if self.libCode is not None:
+            header="//Cg\n//AUTO-GENERATED-SHADER//\n\n"+self.libCode.getSource(stageCode)+"\n\n"
+        return header+"\n\n"+stageCode+self.footer
+    
+    def generateSource(self,renderState):
+        """
+        
+        generates the shader source for the passed RenderState, without using or filling any of this builder's caches
+        
+        returns (stages,source), where stages is the frozenset of stage source strings
+        
+        """
+        with generationLock:
+            return self._generateSourceFromGraph(self.decisionTree.get(renderState))
+    
+    def _generateSourceFromGraph(self,activeGraph):
+        t=stats.shared.start()
+        stages=frozenset(activeGraph.makeStages())
+        stats.shared.stop("makeStages",t)
+        return stages,self.getSource(stages)
+    
+    def generateSources(self,renderStates,processes=None):
+        """
+        
+        generateSource for a list of RenderStates, without using or filling any of this builder's caches.
+        
+        The generator graph is evaluated for all of them at once (see makeActiveGraphs),
+        then the source for each distinct active graph is generated on a pool of processes (see parallel.forkMap).
+        processes defaults to the number of cpus.
+        
+        returns a list with (stages,source) for each RenderState, or the AssertionError if the generator graph rejected it
+        
+        """
+        with generationLock:
+            activeGraphs=makeActiveGraphs(self.nodes,renderStates)
+            distinct=[]
+            seen=set()
+            for activeGraph in activeGraphs:
+                if not isinstance(activeGraph,AssertionError) and activeGraph not in seen:
+                    seen.add(activeGraph)
+                    distinct.append(activeGraph)
+            generated=dict(zip(distinct,parallel.forkMap(self._generateSourceFromGraph,distinct,processes)))
+        return [activeGraph if isinstance(activeGraph,AssertionError) else generated[activeGraph] for activeGraph in activeGraphs]
+
 
 
+# held while generating source (or changing what it is generated from), since the generation caches
+# (ShaderBuilder.decisionTree, stageCache and the ActiveNode flyweights) are not thread safe. See background.py
+generationLock=threading.RLock()
 
 def makeStages(nodes,renderState,debugGraphPath=None):
+    return makeActiveGraph(nodes,renderState).makeStages(debugGraphPath)
+
+def makeActiveGraph(nodes,renderState):
     # process from top down (topological sorted order) to see what part of graph is active, and produce active graph
     # nodes are only processed when all nodes above them have been processed.
+    # nodes is a nodes.FrozenGraph (as made by Library._parseScript), see FrozenGraph.evaluate
     
-    # set of activeNodes that are needed because they produce output values
-    # maps stage to its set of outputs
-    activeOutputs=collections.defaultdict(set)
-    
-    # linksStatus defaults to false for all links.
     # a linkStatus for links (edges) in the active graph may be associated with the link
     # by the node that outputs it when generated.
     # generally false means inactive/not available, and true means available/active
     # though some nodes may use the status differently
-    linkStatus=collections.defaultdict(lambda:False)
-    
-    # dict mapping links to the activeNode that outputs them
-    linkToSource={}
     
     # list of active nodes, in the same order as source nodes, which should be topologically sorted
-    sortedActive=[]
+    sortedActive=nodes.evaluate(renderState)
     
-    # traverse nodes, filling in data-structures inited above.
-    for n in nodes:
-        aa=n.getActiveNodes(renderState,linkStatus)
-        for a in aa:
-            sortedActive.append(a)
+    return ActiveGraph(tuple(sortedActive))
+
+def makeActiveGraphs(nodes_,renderStates):
+    """
+    
+    makeActiveGraph for a list of RenderStates, evaluating the generator graph for all of them at once
+    (see nodes.evaluateBatch). RenderStates that produce the same active nodes share an ActiveGraph.
+    
+    returns a list with the ActiveGraph for each RenderState, or the AssertionError if the generator graph rejected it
+    
+    """
+    t=stats.shared.start()
+    # maps tuples of active nodes to their ActiveGraph
+    activeGraphs={}
+    result=[]
+    for activeNodes in nodes.evaluateBatch(nodes_,renderStates):
+        if isinstance(activeNodes,AssertionError):
+            result.append(activeNodes)
+            continue
+        sortedActive=tuple(activeNodes)
+        activeGraph=activeGraphs.get(sortedActive)
+        if activeGraph is None:
+            activeGraph=activeGraphs[sortedActive]=ActiveGraph(sortedActive)
+        result.append(activeGraph)
+    stats.shared.stop("makeActiveGraphs",t)
+    return result
+
+class ActiveGraph(object):
+    """
+    
+    The Active Graph for a RenderState, as produced by makeActiveGraph.
+    
+    Only depends on the ActiveNodes, so instances can be reused for all RenderStates that
+    produce the same ones (see ShaderBuilder's decisionTree)
+    
+    """
+    def __init__(self,sortedActive):
+        # tuple of active nodes, in the same order as source nodes, which should be topologically sorted
+        self.sortedActive=sortedActive
+        
+        # set of activeNodes that are needed because they produce output values
+        # maps stage to its set of outputs
+        self.activeOutputs=collections.defaultdict(set)
+        
+        # dict mapping links to the activeNode that outputs them
+        self.linkToSource={}
+        
+        for a in sortedActive:
             for link in a.getOutLinks():
-                linkToSource[link]=a
+                self.linkToSource[link]=a
             
             if a.isOutPut():
-                activeOutputs[a.stage].add(a)
+                self.activeOutputs[a.stage].add(a)
+        
+        # the names of the library node types used
+        self.nodeTypes=frozenset(a.nodeType for a in sortedActive if a.nodeType is not None)
+        
+        # maps stage to the tuple of nodes it needs, see findNeededNodes. Computed when first needed.
+        self.neededNodes=None
+    
+    def makeStages(self,debugGraphPath=None):
+        """ yields the source for each of the resulting stages """
+        if self.neededNodes is None:
+            self.neededNodes=findNeededNodes(self.sortedActive,self.activeOutputs,self.linkToSource)
+        path=None
+        for name,neededNodes in sorted(self.neededNodes.iteritems()):
+            if debugGraphPath: path=debugGraphPath+name
+            yield makeStage(name,neededNodes,self.linkToSource,path)
+
+def findNeededNodes(sortedActive,activeOutputs,linkToSource):
+    """
+    
+    finds the nodes each stage requires (recursively) to compute its outputs (aka needed nodes),
+    in a single walk upward from the outputs, tracking the stages that need each node as a bit mask.
     
-    # yield the resulting stages.
-    path=None
-    for name,outputs in activeOutputs.iteritems():
-        if debugGraphPath: path=debugGraphPath+name
-        yield makeStage(name,sortedActive,outputs,linkToSource,path)
+    activeOutputs maps stage to its set of outputs.
     
-def makeStage(name,sortedActive,activeOutputs,linkToSource,debugGraphPath=None):
-    # walk upward from outputs to find nodes the current stage requires recusrivly (aka needed nodes)
+    returns a dict mapping stage to the tuple of its needed nodes, in reverse topological order (bottom up)
     
-    neededSet=set(activeOutputs)
-    neededNodes=[]
+    """
+    stageNames=sorted(activeOutputs)
+    # maps node to the bit mask of the stages that need it
+    masks={}
+    for i,name in enumerate(stageNames):
+        for output in activeOutputs[name]:
+            masks[output]=1<<i
     
+    neededNodes=dict((name,[]) for name in stageNames)
     for n in reversed(sortedActive):
-        if n in neededSet:
-            neededNodes.append(n)
+        mask=masks.get(n)
+        if mask:
+            for i,name in enumerate(stageNames):
+                if mask>>i&1: neededNodes[name].append(n)
             for link in n.getInLinks():
-                neededSet.add(linkToSource[link])
+                source=linkToSource[link]
+                masks[source]=masks.get(source,0)|mask
+    return dict((name,tuple(needed)) for name,needed in neededNodes.iteritems())
+
+def makeStage(name,neededNodes,linkToSource,debugGraphPath=None):
+    """ returns the source for the stage, given its needed nodes (see findNeededNodes) """
+    t=stats.shared.start()
 
     if debugGraphPath:
         import pydot
@@ -482,7 +1150,7 @@ def makeStage(name,sortedActive,activeOutputs,linkToSource,debugGraphPath=None):
         graph = pydot.Dot(graph_type='digraph')
         
             
-        for node in neededSet:
+        for node in neededNodes:
             if isinstance(node,nodes.ActiveOutput):
                 n=pydot.Node(strId(node), label=node.stage+" Output: "+str(node.shaderOutput), shape="rectangle")
             else:
@@ -494,37 +1162,82 @@ def makeStage(name,sortedActive,activeOutputs,linkToSource,debugGraphPath=None):
         
         writeGraph(graph,debugGraphPath)
 
-    return makeStageFromActiveNodes(name,tuple(neededNodes))
+    s=makeStageFromActiveNodes(name,neededNodes)
+    stats.shared.stop("makeStage",t)
+    return s
         
     
 
-stageCache={}
+# a cache of stage source shared by all ShaderBuilders. Maps (stage name,tuple of ActiveNodes) to source
+stageCache=shaderCache.LRUCache()
+
+def setStageCacheLimits(maxEntries=None,maxBytes=None):
+    """ limits the number of entries in, and the total source size of stageCache. None means unlimited. """
+    stageCache.setLimits(maxEntries,maxBytes)
+
+def discardGraph(graph):
+    """
+    removes the entries in stageCache made from graph (a nodes.FrozenGraph).
+    Stage cache keys hold the graph's Links, so once a graph is replaced (ex: by rerunning its script) they can never be used again.
+    """
+    links=set(id(link) for link in graph.links)
+    for key in stageCache.keys():
+        name,activeNodes=key
+        if any(id(link) in links for node in activeNodes for link in itertools.chain(node.getInLinks(),node.getOutLinks())):
+            stageCache.pop(key)
+
 def makeStageFromActiveNodes(name,activeNodes):
     key=(name,activeNodes)
     s=stageCache.get(key)
     if s is None:
-        b=StageBuilder()
+        t=stats.shared.start()
+        b=StageBuilder(findAliases(activeNodes))
         namer=AutoNamer("__"+name+"_")
         for node in activeNodes: b.addNode(node,namer)
         s=b.generateSource(name)
         
-        s="\n\n".join(namer.getItems())+"\n\n"+s
+        # namer maps function bodies to names, so identical functions are only emitted once
+        # (with the debug comments of all the nodes that use them)
+        functions=("".join(c+'\n' for c in b.functionComments.get(fname,()))+"void "+fname+code for code,fname in namer.getItems().iteritems())
+        s="\n\n".join(functions)+"\n\n"+s
+        stats.shared.stop("StageBuilder",t)
         
-        stageCache[key]=s
+        stageCache.put(key,s,len(s))
     return s
 
+def findAliases(activeNodes):
+    """
+    
+    returns a dict mapping the outLinks of the pass through nodes (see nodes.isPassThrough) in activeNodes
+    to what they pass through: the link (or ShaderInput) at the top of the chain of pass throughs.
+    
+    activeNodes are in the order used by StageBuilder (bottom up)
+    
+    """
+    aliases={}
+    for node in reversed(activeNodes):
+        if nodes.isPassThrough(node):
+            source=(node.getInLinks() or node.getShaderInputs())[0]
+            aliases[node.getOutLinks()[0]]=aliases.get(source,source)
+    return aliases
+
 class AutoNamer(object):
     """
     
     A simple class for associating unique names with hashables
     
+    getItems is ordered by when the items were added, so output generated from it is deterministic
+    
     """
     def __init__(self,prefix):
-        self.items={}
+        self.items=collections.OrderedDict()
         self.prefix=prefix
     def addItem(self,item):
-        if item not in self.items:
-            self.items[item]=self.nextName()
+        """ returns the name for item, naming it if it is new """
+        name=self.items.get(item)
+        if name is None:
+            name=self.items[item]=self.nextName()
+        return name
     def getItems(self): return self.items
     def nextName(self): return self.prefix+str(len(self.items))
     
@@ -538,54 +1251,66 @@ class StageBuilder(object):
     
     built bottom up
     
+    aliases maps links to the link or ShaderInput that should be used in their place (see findAliases).
+    The pass through nodes that output aliased links produce no code.
+    
     """
-    def __init__(self):
+    def __init__(self,aliases={}):
+        self.aliases=aliases
         self.links=AutoNamer("__x")
-        self.inputs=set()
-        self.outputs=set()
+        # inputs and outputs are lists (without duplicates) to keep the parameter order deterministic
+        self.inputs=[]
+        self.outputs=[]
         self.sourceLines=[]
+        # if debugText, maps function names to the comments of the nodes that use them (without duplicates)
+        self.functionComments=collections.defaultdict(list)
     def _addLink(self,link):
-        self.links.addItem(link)
+        """ returns the name of the variable or shader input for link """
+        target=self.aliases.get(link,link)
+        if isinstance(target,param.ShaderParam):
+            return target.getName()
+        return self.links.addItem(target)
+    
+    def _addInputs(self,inputs):
+        for i in inputs:
+            if i not in self.inputs: self.inputs.append(i)
         
     def addNode(self,node,functionNamer):
         """
         links=list of links passed to Node's function. Contains in and out ones.
+        
+        functionNamer is an AutoNamer that gets the code of each node's function, and provides its name.
+        Nodes with identical code (such as pass throughs of the same type) share a function.
         """
         if isinstance(node,nodes.ActiveOutput):
-            self._addLink(node.inLink)
             o=node.shaderOutput
-            self.outputs.add(o)
-            code=o.getName()+"="+self.links.getItems()[node.inLink]+";"
+            if o not in self.outputs: self.outputs.append(o)
+            code=o.getName()+"="+self._addLink(node.inLink)+";"
             self.sourceLines.append(code)
+        elif node.getOutLinks()[:1] and node.getOutLinks()[0] in self.aliases:
+            # a pass through: users of its output use its input directly
+            self._addInputs(node.getShaderInputs())
         else:
             inputs=node.getShaderInputs()
-            self.inputs.update(inputs)
+            self._addInputs(inputs)
             
             inLinks=node.getInLinks()
             outLinks=node.getOutLinks()
             
-            for link in itertools.chain(inLinks,outLinks):
-                self._addLink(link)
-                
-            ld=self.links.getItems()
-            
             paramChain=itertools.chain(
                 (s.getName() for s in inputs),
-                (ld[s] for s in itertools.chain(inLinks,outLinks)),
+                (self._addLink(s) for s in itertools.chain(inLinks,outLinks)),
                 )
             
-            fname=functionNamer.nextName()        
+            fname=functionNamer.addItem(node.getCode())
             callSource=fname+"("+",".join(paramChain)+");"
             self.sourceLines.append(callSource)
             
-            # make the function
-            f="void "+fname+node.getCode()
-            
             if debugText:
                 comment="//"+node.getComment()
-                f=comment+'\n'+f
                 self.sourceLines.append('\n'+comment)
-            functionNamer.addItem(f)
+                comments=self.functionComments[fname]
+                if comment not in comments: comments.append(comment)
         
         
     def generateSource(self,name):
@@ -599,3 +1324,10 @@ class StageBuilder(object):
         linkDeclarations='\n'.join(link.getType()+" "+name+";//"+link.name for link,name in self.links.getItems().iteritems())
         source='\n'.join(reversed(self.sourceLines))
         return header+linkDeclarations+'\n\n'+source+'\n'+footer
+
+
+if __name__=="__main__":
+    # allows "python -m shaderBuilder precompile ...", see precompile.py
+    import sys
+    import precompile
+    sys.exit(precompile.main(sys.argv[1:]))
@@ -0,0 +1,231 @@
+import os
+import hashlib
+import collections
+
+"""
+
+Caches used by the shader generator.
+
+LRUCache is an in memory cache with optional limits, used for the caches in ShaderBuilder.
+
+DiskCache is a persistent, write-through cache of generated shader source.
+
+The DiskCache is keyed on the fingerprint of a ShaderBuilder (a hash of its script, and the library it was loaded from)
+and RenderState.getCacheKey(). Source files are stored by content hash, so variants that
+produce the same source share a file.
+
+Layout on disc:
+    path/v<cacheVersion>/<fingerprint>/states/<state hash>   contains the source hash for the state
+    path/v<cacheVersion>/<fingerprint>/sources/<source hash>.sha   contains the shader source
+
+Changing any library file, or the script changes the fingerprint, so stale entries are never used.
+Changing the way source is generated (or this layout) requires bumping cacheVersion.
+
+"""
+
+# bump this when changes are made to shader generation that would make previously cached source invalid
+cacheVersion="6"
+
+def hashString(s):
+    return hashlib.sha1(s).hexdigest()
+
+def fingerprint(*parts):
+    """ combines the passed strings into a single hash, suitable for use as a DiskCache fingerprint """
+    h=hashlib.sha1()
+    for p in parts:
+        h.update(hashString(p))
+    return h.hexdigest()
+
+def _writeFile(path,data):
+    """
+    writes data to path such that readers will never see a partial file,
+    even when several processes write the same entry
+    """
+    tempPath=path+"."+str(os.getpid())+".tmp"
+    f=open(tempPath,'wb')
+    f.write(data)
+    f.close()
+    try:
+        os.rename(tempPath,path)
+    except OSError:
+        # rename can fail if the file exists on some platforms. Some other writer got there first.
+        os.remove(tempPath)
+
+def _readFile(path):
+    try:
+        f=open(path,'rb')
+    except IOError:
+        return None
+    data=f.read()
+    f.close()
+    return data
+
+class DiskCache(object):
+    """
+
+    A cache of shader source on disc for a single ShaderBuilder.
+
+    fingerprint should change whenever anything that can change the generated source does.
+    See Library.loadScript
+
+    """
+    def __init__(self,path,fingerprint):
+        self.path=os.path.join(path,"v"+cacheVersion,fingerprint)
+        self.statesPath=os.path.join(self.path,"states")
+        self.sourcesPath=os.path.join(self.path,"sources")
+        for p in (self.statesPath,self.sourcesPath):
+            if not os.path.isdir(p): os.makedirs(p)
+        self.resetStats()
+    
+    def resetStats(self):
+        self.hits=0
+        self.misses=0
+        self.writes=0
+    
+    def getStats(self):
+        """ returns a dict of statistics about this cache """
+        return {"hits":self.hits,"misses":self.misses,"writes":self.writes}
+
+    def _sourcePath(self,sourceHash):
+        return os.path.join(self.sourcesPath,sourceHash+".sha")
+
+    def get(self,renderState):
+        """ returns the cached source for renderState, or None if not cached """
+        sourceHash=_readFile(os.path.join(self.statesPath,hashString(renderState.getCacheKey())))
+        source=None
+        if sourceHash is not None:
+            source=_readFile(self._sourcePath(sourceHash))
+        if source is None:
+            self.misses+=1
+        else:
+            self.hits+=1
+        return source
+
+    def put(self,renderState,source):
+        """ stores source as the shader source for renderState. Returns the source hash. """
+        sourceHash=self.putSource(source)
+        self.putSourceHash(renderState,sourceHash)
+        return sourceHash
+    
+    def putSource(self,source):
+        """ stores source (if it is not already stored), without associating it with any RenderState. Returns the source hash. """
+        sourceHash=hashString(source)
+        if not self.hasSource(sourceHash):
+            _writeFile(self._sourcePath(sourceHash),source)
+        return sourceHash
+    
+    def hasSource(self,sourceHash):
+        """ returns True if the source with hash sourceHash is stored (see putSource) """
+        return os.path.exists(self._sourcePath(sourceHash))
+    
+    def putSourceHash(self,renderState,sourceHash):
+        """ makes the source stored with hash sourceHash (see putSource) the shader source for renderState """
+        self.writes+=1
+        _writeFile(os.path.join(self.statesPath,hashString(renderState.getCacheKey())),sourceHash)
+
+
+class LRUCache(object):
+    """
+    
+    A dict like cache with optional limits on the number of entries (maxEntries),
+    and on the total size of the entries (maxBytes, using sizes passed to put).
+    When a limit is exceeded, the least recently used entries are evicted.
+    
+    With no limits (the default), nothing is ever evicted, and recency is not tracked.
+    
+    Hit, miss and eviction counts are kept to help choose limits, see getStats.
+    
+    """
+    def __init__(self,maxEntries=None,maxBytes=None):
+        # maps key to (value,size), in order from least to most recently used
+        self._items=collections.OrderedDict()
+        self.bytes=0
+        self.maxEntries=None
+        self.maxBytes=None
+        self.resetStats()
+        self.setLimits(maxEntries,maxBytes)
+    
+    def setLimits(self,maxEntries=None,maxBytes=None):
+        """ sets the limits (None means unlimited), evicting entries if needed """
+        self.maxEntries=maxEntries
+        self.maxBytes=maxBytes
+        self._bounded=maxEntries is not None or maxBytes is not None
+        self._evict()
+    
+    def get(self,key,default=None):
+        if self._bounded:
+            item=self._items.pop(key,None)
+            if item is not None:
+                self._items[key]=item
+        else:
+            item=self._items.get(key)
+        if item is None:
+            self.misses+=1
+            return default
+        self.hits+=1
+        return item[0]
+    
+    def put(self,key,value,size=0):
+        """ adds or replaces an entry. size is counted against maxBytes """
+        old=self._items.pop(key,None)
+        if old is not None:
+            self.bytes-=old[1]
+        self._items[key]=(value,size)
+        self.bytes+=size
+        self._evict()
+    
+    def __setitem__(self,key,value):
+        self.put(key,value)
+    
+    def pop(self,key,default=None):
+        """ removes an entry, returning its value (does not count as an eviction) """
+        item=self._items.pop(key,None)
+        if item is None: return default
+        self.bytes-=item[1]
+        return item[0]
+    
+    def __contains__(self,key):
+        return key in self._items
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def keys(self):
+        return self._items.keys()
+    
+    def items(self):
+        """ returns a list of (key,value), without affecting recency or statistics """
+        return [(key,item[0]) for key,item in self._items.iteritems()]
+    
+    def clear(self):
+        self._items.clear()
+        self.bytes=0
+    
+    def _evict(self):
+        if not self._bounded: return
+        while self._items and (
+                (self.maxEntries is not None and len(self._items)>self.maxEntries) or
+                (self.maxBytes is not None and self.bytes>self.maxBytes)):
+            key,(value,size)=self._items.popitem(last=False)
+            self.bytes-=size
+            self.evictions+=1
+            self.evictedBytes+=size
+    
+    def resetStats(self):
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self.evictedBytes=0
+    
+    def getStats(self):
+        """ returns a dict of statistics about this cache """
+        return {
+            "entries":len(self._items),
+            "bytes":self.bytes,
+            "maxEntries":self.maxEntries,
+            "maxBytes":self.maxBytes,
+            "hits":self.hits,
+            "misses":self.misses,
+            "evictions":self.evictions,
+            "evictedBytes":self.evictedBytes,
+            }
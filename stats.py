@@ -0,0 +1,55 @@
+import timeit
+
+"""
+
+Timers for seeing where shader generation time goes.
+
+They are disabled by default, and cost very little (a None check per timed phase) while disabled,
+so the calls can stay in production builds. Enable them with shared.enabled=True
+(or ShaderBuilder.enableStats), and read them with ShaderBuilder.getStats or manager.Manager.getStats.
+
+The timers are shared by everything in the process (some of the timed phases, like makeStage, are not specific
+to a ShaderBuilder). Cache statistics are kept by the caches themselves, see shaderCache.LRUCache.
+
+"""
+
+timer=timeit.default_timer
+
+class Stats(object):
+    """
+    
+    Accumulates the total time and number of calls for named phases.
+    
+    Usage:
+        t=stats.start()
+        ... timed phase ...
+        stats.stop("phase name",t)
+    
+    """
+    def __init__(self,enabled=False):
+        self.enabled=enabled
+        self.reset()
+    
+    def reset(self):
+        # maps phase name to total seconds
+        self.times={}
+        # maps phase name to number of calls
+        self.counts={}
+    
+    def start(self):
+        """ returns a start time to pass to stop, or None if disabled """
+        if self.enabled: return timer()
+        return None
+    
+    def stop(self,name,start):
+        """ adds the time since start (from the start method) to the phase """
+        if start is not None:
+            self.times[name]=self.times.get(name,0.0)+timer()-start
+            self.counts[name]=self.counts.get(name,0)+1
+    
+    def getStats(self):
+        """ returns a snapshot: a dict with the "times" and "counts" dicts """
+        return {"times":dict(self.times),"counts":dict(self.counts)}
+
+# the Stats used by the shader generator
+shared=Stats()